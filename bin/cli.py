@@ -5,6 +5,7 @@ import os
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/..")
 
 from bin.commands.serve import serve
+from bin.commands.benchmark import benchmark
 
 
 @click.group()
@@ -13,6 +14,7 @@ def cli():
 
 
 cli.add_command(serve)
+cli.add_command(benchmark)
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,90 @@
+import click
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+
+def time_calls(f, n_calls):
+    """
+    Calls f n_calls times and returns the per-call latencies in milliseconds.
+    """
+    latencies = np.zeros(n_calls)
+
+    # silence the per-run timing prints of the model
+    with contextlib.redirect_stdout(io.StringIO()):
+        f()  # exclude first call from timings
+
+        for i in range(n_calls):
+            t1 = time.perf_counter()
+            f()
+            latencies[i] = (time.perf_counter() - t1) * 1000
+
+    return latencies
+
+
+def report(label, latencies):
+    click.echo(
+        f"{label:<32} mean {latencies.mean():8.3f} ms   "
+        f"median {np.median(latencies):8.3f} ms   "
+        f"p95 {np.percentile(latencies, 95):8.3f} ms"
+    )
+
+
+@click.group()
+def benchmark():
+    pass
+
+
+@benchmark.command()
+@click.option("--protocol", default="pva", show_default=True)
+@click.option("--n-calls", default=200, show_default=True)
+def predict(protocol, n_calls):
+    """
+    Compare single-sample latency of keras Model.predict with the direct inference \
+    path used by OnlineSurrogateModel.run.
+    """
+    # the protocol must be set to import the model info
+    os.environ["PROTOCOL"] = protocol
+
+    from online_model.model.MySurrogateModel import MySurrogateModel
+    from online_model.model.surrogate_model import OnlineSurrogateModel
+    from online_model import CMD_PVDB, MODEL_KWARGS
+    from tensorflow import keras
+
+    surrogate_model = MySurrogateModel(**MODEL_KWARGS)
+    online_model = OnlineSurrogateModel([surrogate_model])
+    pv_state = {pv: CMD_PVDB[pv]["value"] for pv in CMD_PVDB}
+
+    vec = np.array([[pv_state[key] for key in surrogate_model.input_ordering]])
+    image = np.array([surrogate_model.stock_image_input])
+    model_inputs = [
+        surrogate_model.scale_image(image),
+        surrogate_model.scale_inputs(vec),
+    ]
+
+    # session callable for the full model, comparable with Model.predict
+    with surrogate_model.thread_graph.as_default():
+        with surrogate_model.session.as_default():
+            inference_function = keras.backend.function(
+                surrogate_model.model.inputs, surrogate_model.model.outputs
+            )
+
+    def keras_predict():
+        with surrogate_model.thread_graph.as_default():
+            with surrogate_model.session.as_default():
+                surrogate_model.model.predict(model_inputs)
+
+    def direct_call():
+        with surrogate_model.thread_graph.as_default():
+            with surrogate_model.session.as_default():
+                inference_function(model_inputs)
+
+    report("keras Model.predict", time_calls(keras_predict, n_calls))
+    report("direct session call", time_calls(direct_call, n_calls))
+    report(
+        "OnlineSurrogateModel.run",
+        time_calls(lambda: online_model.run(dict(pv_state)), n_calls),
+    )
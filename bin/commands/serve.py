@@ -9,7 +9,59 @@ def serve():
 
 @serve.command()
 @click.argument("protocol")
-def start_server(protocol):
+@click.option(
+    "--max-batch-size",
+    default=16,
+    show_default=True,
+    help="Maximum number of puts evaluated in one model call (pva only).",
+)
+@click.option(
+    "--max-batch-wait",
+    default=0.005,
+    show_default=True,
+    help="Maximum seconds to wait for puts to fill a batch (pva only).",
+)
+@click.option(
+    "--cache-size",
+    default=0,
+    show_default=True,
+    help="Number of model outputs to keep in the prediction cache (0 disables).",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    help="Number of inference threads sharing the model (pva without --asyncio).",
+)
+@click.option(
+    "--processes",
+    default=0,
+    show_default=True,
+    help="Number of model worker processes (0 runs the model in the server process).",
+)
+@click.option(
+    "--coalesce/--no-coalesce",
+    default=False,
+    show_default=True,
+    help="Evaluate only the latest pending input state (pva; ca always coalesces).",
+)
+@click.option(
+    "--asyncio/--no-asyncio",
+    "use_asyncio",
+    default=False,
+    show_default=True,
+    help="Serve from an asyncio event loop, running inference in an executor (pva).",
+)
+def start_server(
+    protocol,
+    max_batch_size,
+    max_batch_wait,
+    cache_size,
+    workers,
+    processes,
+    coalesce,
+    use_asyncio,
+):
     """
     Start server using given PROTOCOL.
 
@@ -25,13 +77,47 @@ def start_server(protocol):
     if protocol == "ca":
         from online_model.server.ca import CAServer
 
-        server = CAServer(MySurrogateModel, MODEL_KWARGS, CMD_PVDB, SIM_PVDB, PREFIX)
+        server = CAServer(
+            MySurrogateModel,
+            MODEL_KWARGS,
+            CMD_PVDB,
+            SIM_PVDB,
+            PREFIX,
+            cache_size=cache_size,
+            num_processes=processes,
+        )
+        server.start_server()
+
+    elif protocol == "pva" and use_asyncio:
+        from online_model.server.pva_asyncio import AsyncPVAServer
+
+        server = AsyncPVAServer(
+            MySurrogateModel,
+            MODEL_KWARGS,
+            CMD_PVDB,
+            SIM_PVDB,
+            PREFIX,
+            cache_size=cache_size,
+            num_processes=processes,
+        )
         server.start_server()
 
     elif protocol == "pva":
         from online_model.server.pva import PVAServer
 
-        server = PVAServer(MySurrogateModel, MODEL_KWARGS, CMD_PVDB, SIM_PVDB, PREFIX)
+        server = PVAServer(
+            MySurrogateModel,
+            MODEL_KWARGS,
+            CMD_PVDB,
+            SIM_PVDB,
+            PREFIX,
+            max_batch_size=max_batch_size,
+            max_batch_wait=max_batch_wait,
+            cache_size=cache_size,
+            num_workers=workers,
+            num_processes=processes,
+            coalesce=coalesce,
+        )
         server.start_server()
 
     else:
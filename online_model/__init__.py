@@ -1,7 +1,13 @@
 import os
 import h5py
 import numpy as np
-from online_model.util import fix_units, build_image_pvs
+from online_model.util import (
+    fix_units,
+    build_image_pvs,
+    pva_field_name,
+    CA_ARRAY_TYPES,
+    CODECS,
+)
 
 # set keras backend to tensorflow to prevent theano import errors
 os.environ["KERAS_BACKEND"] = "tensorflow"
@@ -21,6 +27,21 @@ STOCK_LASER_IMAGE = "online_model/files/example_input_image.npy"
 # pva prefix
 PREFIX = "smvm"
 
+# client read timeouts in seconds: PV_TIMEOUT sets the default and PV_TIMEOUTS
+# overrides it per process variable (without prefix), e.g. "x:y=2,snapshot=0.5"
+DEFAULT_PV_TIMEOUT = float(os.environ.get("PV_TIMEOUT", 1.0))
+PV_TIMEOUTS = {}
+for item in os.environ.get("PV_TIMEOUTS", "").split(","):
+    if item.strip():
+        pv, timeout = item.rsplit("=", 1)
+        PV_TIMEOUTS[pv.strip()] = float(timeout)
+
+# maximum number of slider puts per second to each process variable, 0 for no limit
+MAX_PUT_RATE = float(os.environ.get("PUT_RATE", 10.0))
+
+# put slider values only once dragging ends, where bokeh supports value_throttled
+THROTTLE_SLIDERS = os.environ.get("THROTTLE_SLIDERS", "1").lower() not in ("0", "false")
+
 # Build model info
 MODEL_INFO = {}
 with h5py.File(MODEL_FILE, "r") as h5:
@@ -67,6 +88,32 @@ for ii, input_name in enumerate(MODEL_INFO["input_names"]):
         "range": list(MODEL_INFO["input_ranges"][ii]),
     }
 
+# aggregate input pv setting every input in one write, ordered as the model inputs
+INPUT_ORDERING = [
+    f"in_{input_name}" if input_name in REDUNDANT_INPUT_OUTPUT else input_name
+    for input_name in MODEL_INFO["input_ordering"]
+]
+INPUT_ARRAY_PV = "inputs"
+INPUT_ARRAY_PVDB = {
+    INPUT_ARRAY_PV: {
+        "type": "float",
+        "prec": DEFAULT_PRECISION,
+        "count": len(INPUT_ORDERING),
+        "value": [CMD_PVDB[pv]["value"] for pv in INPUT_ORDERING],
+    }
+}
+
+# batch evaluation rpc pvs take an NTTable with one column per model input, named
+# after MODEL_INFO["input_names"] as valid pvData field names, and map the columns
+# back to the input process variables
+BATCH_PV = "evaluate"
+BATCH_IMAGE_PV = "evaluate:image"
+BATCH_INPUT_COLUMNS = {
+    pva_field_name(input_name): label
+    for input_name, label in zip(MODEL_INFO["input_names"], CMD_PVDB)
+}
+
+# output pvs may set "mdel" to only publish changes larger than that deadband
 SIM_PVDB = {}
 for ii, output_name in enumerate(MODEL_INFO["output_names"]):
     label = output_name
@@ -81,11 +128,38 @@ for ii, output_name in enumerate(MODEL_INFO["output_names"]):
     }
 
 
+# aggregate snapshot pv holding every scalar output of one model evaluation, laid
+# out as [input state sequence number, timestamp, *outputs in SNAPSHOT_ORDERING]
+SNAPSHOT_PV = "snapshot"
+SNAPSHOT_ORDERING = list(SIM_PVDB)
+SNAPSHOT_PVDB = {
+    SNAPSHOT_PV: {
+        "type": "float",
+        "prec": DEFAULT_PRECISION,
+        "count": len(SNAPSHOT_ORDERING) + 2,
+        "value": [0.0] * (len(SNAPSHOT_ORDERING) + 2),
+    }
+}
+
 # sim_pvdb['z:pz']={'type': 'float', 'prec': 8, 'count':len(default_output['z:pz']),'units':'mm:delta','value':list(default_output['z:pz'])}
 
 IMAGE_SHAPE = np.array([50, 50])
 IMAGE_UNITS = "mm:mm"
 
+# image payload encoding: dtype is one of "float64", "float32", "uint16" or "uint8"
+# (integer encodings are published with a scale and offset), codec optionally
+# compresses pva images with "zlib", "lz4" or "blosc"
+IMAGE_ENCODING = {
+    "dtype": os.environ.get("IMAGE_DTYPE", "float64"),
+    "codec": os.environ.get("IMAGE_CODEC"),
+}
+
+if IMAGE_ENCODING["dtype"] not in CA_ARRAY_TYPES:
+    raise ValueError(f"Image dtype must be one of {list(CA_ARRAY_TYPES)}")
+
+if IMAGE_ENCODING["codec"] and IMAGE_ENCODING["codec"] not in CODECS:
+    raise ValueError(f"Image codec must be one of {CODECS}")
+
 # TODO: ASSIGN START FOR PVA
 if PROTOCOL == "pva":
     SIM_PVDB["x:y"] = {
@@ -101,9 +175,17 @@ elif PROTOCOL == "ca":
         IMAGE_UNITS,  # get units
         DEFAULT_PRECISION,
         DEFAULT_COLOR_MODE,
+        IMAGE_ENCODING["dtype"],
     )
     SIM_PVDB.update(image_pvs)
 
 ARRAY_PVS = ["x:y"]
+ARRAY_ENCODINGS = {"x:y": IMAGE_ENCODING}
+
+# server statistics, served alongside the model outputs
+STATS_PVDB = {
+    "stale_drops": {"type": "int", "value": 0},
+    "stale_results": {"type": "int", "value": 0},
+}
 
 MODEL_KWARGS = {"model_file": MODEL_FILE, "stock_image_input": DEFAULT_LASER_IMAGE}
@@ -1,13 +1,225 @@
-from typing import Union
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, List, Tuple, Union
 import numpy as np
-import copy
-from epics import caget, caput
+from epics import caget, caget_many, caput, camonitor, camonitor_clear
 from p4p.client.thread import Context
 
+from online_model.util import decode_array, decompress_bytes, ND_DATA_TYPES
+
+# numpy dtypes by NDArray data type code
+ND_DTYPES = {code: np.dtype(name) for name, code in ND_DATA_TYPES.items()}
+
+
+class FrameNotReadyError(Exception):
+    """
+    Raised when the process variables of an image frame do not all belong to the \\
+    same frame yet, e.g. when the encoding of a new frame has not been received. \\
+    The read should be retried.
+    """
+
+
+class ValueCache:
+    """
+    Thread safe mapping of process variable names to their latest value and \
+    timestamp, filled from subscription callbacks.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize empty cache.
+        """
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, pvname: str) -> bool:
+        with self._lock:
+            return pvname in self._entries
+
+    def update(self, pvname: str, value, timestamp: float) -> None:
+        """
+        Store the latest value of a process variable.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the process variable
+
+        value
+            Latest value
+
+        timestamp: float
+            Time of the update in seconds since the epoch
+
+        """
+        with self._lock:
+            self._entries[pvname] = (value, timestamp)
+
+    def discard(self, pvname: str) -> None:
+        """
+        Drop the value of a process variable, e.g. on disconnect.
+        """
+        with self._lock:
+            self._entries.pop(pvname, None)
+
+    def get(self, pvname: str) -> Tuple:
+        """
+        Get the latest value and timestamp of a process variable.
+
+        Returns
+        -------
+        tuple
+            Value and timestamp, or None if no value has been received.
+        """
+        with self._lock:
+            return self._entries.get(pvname)
+
+
+class PutQueue:
+    """
+    Rate limited queue of process variable puts, issued from a worker thread. Only \
+    the latest value of each process variable is kept: values superseded before \
+    being put are dropped, and each process variable is put at most max_rate times \
+    per second.
+
+    Attributes
+    ----------
+    max_rate: float
+        Maximum number of puts per second to each process variable, unlimited if 0
+
+    dropped: int
+        Number of values superseded before being put
+
+    """
+
+    def __init__(self, put: Callable, max_rate: float = 10.0) -> None:
+        """
+        Start the worker thread.
+
+        Parameters
+        ----------
+        put: callable
+            Function putting a value, called with the process variable name and value
+
+        max_rate: float
+            Maximum number of puts per second to each process variable, unlimited \
+            if 0
+
+        """
+        self.max_rate = max_rate
+        self.dropped = 0
+
+        self._put = put
+        self._pending = {}
+        self._last_put = {}
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, pvname: str, value) -> None:
+        """
+        Queue a value to put, replacing any value of the process variable still \
+        waiting to be put.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the process variable
+
+        value
+            Value to put
+
+        """
+        with self._condition:
+            if pvname in self._pending:
+                self.dropped += 1
+
+            self._pending[pvname] = value
+            self._condition.notify()
+
+    def _next(self) -> Tuple:
+        """
+        Wait for the next put allowed by the rate limit.
+
+        Returns
+        -------
+        tuple
+            Process variable name and value, or None once closed
+        """
+        interval = 1.0 / self.max_rate if self.max_rate else 0.0
+
+        with self._condition:
+            while not self._closed:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+
+                due = {
+                    pvname: self._last_put.get(pvname, -np.inf) + interval
+                    for pvname in self._pending
+                }
+                pvname = min(due, key=due.get)
+
+                now = time.time()
+                if due[pvname] > now:
+                    self._condition.wait(due[pvname] - now)
+                    continue
+
+                self._last_put[pvname] = now
+                return pvname, self._pending.pop(pvname)
+
+        return None
+
+    def _run(self) -> None:
+        """
+        Worker loop issuing the queued puts.
+        """
+        while True:
+            item = self._next()
+            if item is None:
+                return
+
+            pvname, value = item
+            try:
+                self._put(pvname, value)
+
+            except Exception as e:
+                print(f"Unable to put {pvname}")
+                print(e)
+
+    def close(self) -> None:
+        """
+        Stop the worker, dropping the values still waiting to be put.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+
+def value_timestamp(value) -> float:
+    """
+    Get the server timestamp of a p4p value in seconds since the epoch, falling \
+    back on the current time.
+    """
+    timestamp = getattr(value, "timestamp", None)
+    if timestamp is not None:
+        return timestamp
+
+    try:
+        return value.timeStamp.secondsPastEpoch + value.timeStamp.nanoseconds * 1e-9
+
+    except AttributeError:
+        return time.time()
+
 
 class Controller:
     """
-    Controller class used to get and put process variables.
+    Controller class used to get and put process variables. Reads subscribe to the \
+    process variable, so that later reads are served from a cache of the latest \
+    monitored values without a network round-trip.
 
     Attributes
     ----------
@@ -17,22 +229,160 @@ class Controller:
     context: p4p.client.thread.Context
         p4p threaded context instance
 
+    raw_context: p4p.client.thread.Context
+        p4p threaded context instance returning raw Values, used for images which \
+        may be compressed
+
+    cache: online_model.app.controllers.ValueCache
+        Latest monitored values
+
+    raw_cache: online_model.app.controllers.ValueCache
+        Latest monitored raw Values of the raw context
+
+    timeout: float
+        Default time in seconds to wait for a process variable before giving up
+
+    timeouts: dict
+        Mapping of process variable names to timeouts overriding the default
+
+    put_queue: online_model.app.controllers.PutQueue
+        Queue of the rate limited puts made with queue_put
+
     """
 
-    def __init__(self, protocol: str):
+    def __init__(
+        self,
+        protocol: str,
+        timeout: float = 5.0,
+        timeouts: Dict[str, float] = None,
+        max_put_rate: float = 10.0,
+    ):
         """
-        Store protocol and initialize context if using PVAccess.
+        Store protocol and timeouts, initialize context if using PVAccess and start \
+        the put queue.
         """
         self.protocol = protocol
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.put_queue = PutQueue(self._put_nowait, max_put_rate)
 
         # initalize context for pva
         self.context = None
+        self.raw_context = None
         if protocol == "pva":
             self.context = Context("pva")
+            self.raw_context = Context("pva", nt=False)
+
+        # values received from subscriptions
+        self.cache = ValueCache()
+        self.raw_cache = ValueCache()
+        self._subscriptions = {}
+        self._subscription_lock = threading.Lock()
+
+    def timeout_for(self, pvname: str) -> float:
+        """
+        Get the time in seconds to wait for a process variable.
+        """
+        return self.timeouts.get(pvname, self.timeout)
+
+    def subscribe(self, pvname: str, raw: bool = False) -> None:
+        """
+        Subscribe to a process variable, keeping its latest value in the cache. \
+        Subscribing more than once has no effect.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the process variable
+
+        raw: bool
+            Monitor with the raw context (pva only)
+
+        """
+        with self._subscription_lock:
+            if (pvname, raw) in self._subscriptions:
+                return
+
+            if self.protocol == "ca":
+                camonitor(
+                    pvname,
+                    callback=self._update_from_ca,
+                    connection_timeout=self.timeout_for(pvname),
+                )
+                subscription = None
+
+            elif raw:
+                subscription = self.raw_context.monitor(
+                    pvname,
+                    partial(self._update_from_pva, pvname, self.raw_cache),
+                    notify_disconnect=True,
+                )
+
+            else:
+                subscription = self.context.monitor(
+                    pvname,
+                    partial(self._update_from_pva, pvname, self.cache),
+                    notify_disconnect=True,
+                )
+
+            self._subscriptions[(pvname, raw)] = subscription
+
+    def _update_from_ca(self, pvname=None, value=None, timestamp=None, **kws) -> None:
+        """
+        Channel access monitor callback.
+        """
+        self.cache.update(pvname, value, timestamp)
+
+    def _update_from_pva(self, pvname: str, cache: ValueCache, value) -> None:
+        """
+        PVAccess monitor callback. Disconnects and errors are delivered as \
+        exceptions and clear the cached value.
+        """
+        if isinstance(value, Exception):
+            cache.discard(pvname)
+
+        else:
+            cache.update(pvname, value, value_timestamp(value))
+
+    def get_cached(self, pvname: str) -> Tuple:
+        """
+        Get the latest monitored value of a process variable and its timestamp \
+        without blocking.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the process variable
+
+        Returns
+        -------
+        tuple
+            Value and timestamp, or None if no value has been received yet.
+
+        """
+        self.subscribe(pvname)
+        return self.cache.get(pvname)
+
+    def close(self) -> None:
+        """
+        Cancel all subscriptions and stop the put queue.
+        """
+        self.put_queue.close()
+
+        with self._subscription_lock:
+            for (pvname, raw), subscription in self._subscriptions.items():
+                if self.protocol == "ca":
+                    camonitor_clear(pvname)
+
+                else:
+                    subscription.close()
+
+            self._subscriptions = {}
 
     def get(self, pvname: str):
         """
-        Get the value of a process variable.
+        Get the value of a process variable. The latest monitored value is returned \
+        if available, otherwise the value is read from the server.
 
         Parameters
         ----------
@@ -44,12 +394,68 @@ class Controller:
         np.ndarray
             Returns numpy array containing value.
 
+        Raises
+        ------
+        TimeoutError
+            If the process variable could not be read within its timeout
+
         """
+        cached = self.get_cached(pvname)
+        if cached is not None:
+            return cached[0]
+
+        timeout = self.timeout_for(pvname)
+
         if self.protocol == "ca":
-            return caget(pvname)
+            value = caget(pvname, timeout=timeout)
+            if value is None:
+                raise TimeoutError(f"Unable to read {pvname}")
+
+            return value
 
         elif self.protocol == "pva":
-            return self.context.get(pvname)
+            return self.context.get(pvname, timeout=timeout)
+
+    def get_many(self, pvnames: List[str]) -> list:
+        """
+        Get the values of many process variables. Monitored values are taken from \
+        the cache, the remaining values are read in parallel, issuing all requests \
+        before waiting for any reply. Channels are created once and reused by later \
+        calls (pyepics keeps its channel cache, p4p its context channels).
+
+        Parameters
+        ----------
+        pvnames: list
+            Names of the process variables
+
+        Returns
+        -------
+        list
+            Values in the order of pvnames, None for process variables that could \
+            not be read.
+
+        """
+        cached_values = [self.get_cached(pvname) for pvname in pvnames]
+        values = [None if cached is None else cached[0] for cached in cached_values]
+        missing = [i for i, cached in enumerate(cached_values) if cached is None]
+
+        if missing:
+            missing_pvnames = [pvnames[i] for i in missing]
+            timeout = max(self.timeout_for(pvname) for pvname in missing_pvnames)
+
+            if self.protocol == "ca":
+                read = caget_many(
+                    missing_pvnames, timeout=timeout, connection_timeout=timeout
+                )
+
+            elif self.protocol == "pva":
+                read = self.context.get(missing_pvnames, timeout=timeout, throw=False)
+                read = [None if isinstance(v, Exception) else v for v in read]
+
+            for i, value in zip(missing, read):
+                values[i] = value
+
+        return values
 
     def get_image(self, pvname):
         """
@@ -73,25 +479,53 @@ class Controller:
                 "dh": [float],
             }
             ```
+
+        Raises
+        ------
+        TimeoutError
+            If a process variable of the image could not be read
+
+        FrameNotReadyError
+            If the encoding of the latest frame has not been received yet
         """
         if self.protocol == "ca":
             pvname = pvname.replace(":ArrayData_RBV", "")
-            nx = self.get(f"{pvname}:ArraySizeX_RBV")
-            ny = self.get(f"{pvname}:ArraySizeY_RBV")
-            dw = self.get(f"{pvname}:dw")
-            dh = self.get(f"{pvname}:dh")
-            image = self.get(f"{pvname}:ArrayData_RBV")
+            pvnames = [
+                f"{pvname}:ArrayCounter_RBV",
+                f"{pvname}:ArraySizeX_RBV",
+                f"{pvname}:ArraySizeY_RBV",
+                f"{pvname}:dw",
+                f"{pvname}:dh",
+                f"{pvname}:ArrayData_RBV",
+            ]
+            values = self.get_many(pvnames)
+
+            for name, value in zip(pvnames, values):
+                if value is None:
+                    raise TimeoutError(f"Unable to read {name}")
+
+            counter, nx, ny, dw, dh, image = values
             image = image.reshape(int(nx), int(ny))
 
+            # integer encoded images are served with their scale and offset, tagged
+            # with the counter of the frame they belong to
+            if image.dtype.kind in "iu":
+                frame, scale, offset = self.get(f"{pvname}:encoding")
+
+                if int(frame) != int(counter):
+                    raise FrameNotReadyError(
+                        f"Encoding of {pvname} frame {int(counter)} not yet received"
+                    )
+
+                image = decode_array(image, scale, offset)
+
         elif self.protocol == "pva":
-            # context returns np array with WRITEABLE=False
-            # copy to manipulate array below
-            output = self.get(pvname)
-            attrib = output.attrib
+            image, attrib = self.get_ntndarray(pvname)
             dw = attrib["dw"]
             dh = attrib["dh"]
-            nx, ny = output.shape
-            image = copy.copy(output)
+            image = decode_array(
+                image, attrib.get("scale", 1.0), attrib.get("offset", 0.0)
+            )
 
         return {
             "image": [image],
@@ -101,6 +535,72 @@ class Controller:
             "dh": [dh],
         }
 
+    def get_ntndarray(self, pvname: str):
+        """
+        Get an NTNDArray process variable, decompressing the data if a codec is set.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the process variable
+
+        Returns
+        -------
+        tuple
+            Image array and dictionary of NDArray attributes
+        """
+        output = self._get_raw(pvname)
+
+        # inner-most dimension is sent first
+        shape = [dimension.size for dimension in output.dimension][::-1]
+        attrib = {attribute.name: attribute.value for attribute in output.attribute}
+
+        # copy, the context returns arrays with WRITEABLE=False
+        data = np.array(output.value)
+
+        if output.codec.name:
+            uncompressed = decompress_bytes(
+                data.tobytes(), output.codec.name, output.uncompressedSize
+            )
+            dtype = ND_DTYPES[output.codec.parameters]
+            data = np.frombuffer(uncompressed, dtype=dtype).copy()
+
+        return data.reshape(shape), attrib
+
+    def get_image_id(self, pvname: str) -> int:
+        """
+        Get the identifier of the latest image frame, which changes with every new \\
+        frame published by the server: the NTNDArray uniqueId for pva and the \\
+        array counter for ca.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the image process variable
+
+        Returns
+        -------
+        int
+            Frame identifier
+        """
+        if self.protocol == "ca":
+            pvname = pvname.replace(":ArrayData_RBV", "")
+            return self.get(f"{pvname}:ArrayCounter_RBV")
+
+        return self._get_raw(pvname).uniqueId
+
+    def _get_raw(self, pvname: str):
+        """
+        Get the unwrapped value of a pva process variable, from the cache if \\
+        subscribed.
+        """
+        self.subscribe(pvname, raw=True)
+        cached = self.raw_cache.get(pvname)
+        if cached is None:
+            return self.raw_context.get(pvname, timeout=self.timeout_for(pvname))
+
+        return cached[0]
+
     def put(self, pvname, value: Union[np.ndarray, float]) -> None:
         """
         Assign the value of a process variable.
@@ -119,3 +619,31 @@ class Controller:
 
         elif self.protocol == "pva":
             self.context.put(pvname, value)
+
+    def queue_put(self, pvname: str, value: Union[np.ndarray, float]) -> None:
+        """
+        Assign the value of a process variable without blocking. The put is issued \
+        from the put queue worker, rate limited, and dropped if superseded by a \
+        newer value before being issued.
+
+        Parameters
+        ----------
+        pvname: str
+            Name of the process variable
+
+        value
+            Value to put. Either float or numpy array
+
+        """
+        self.put_queue.submit(pvname, value)
+
+    def _put_nowait(self, pvname: str, value: Union[np.ndarray, float]) -> None:
+        """
+        Put queue callback. Channel access puts return once sent, pva puts wait \
+        for completion on the put queue worker at most the process variable timeout.
+        """
+        if self.protocol == "ca":
+            caput(pvname, value, wait=False)
+
+        elif self.protocol == "pva":
+            self.context.put(pvname, value, timeout=self.timeout_for(pvname))
@@ -0,0 +1,275 @@
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+# bin widths in seconds of the decimated history levels
+DEFAULT_RESOLUTIONS = (1.0, 10.0, 60.0)
+
+# number of samples held by each history level
+DEFAULT_LEVEL_CAPACITY = 3600
+
+
+class TimeSeriesBuffer:
+    """
+    Fixed capacity ring buffer of (time, value) samples. Storage is preallocated \\
+    and every sample is written twice, capacity apart, so that the most recent \\
+    samples are always contiguous and can be returned as views without copying.
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of samples held; older samples are overwritten
+
+    window: float
+        If set, views only include samples from the last window seconds
+
+    columns: int
+        Number of values per sample
+
+    """
+
+    def __init__(self, capacity: int, window: float = None, columns: int = 1) -> None:
+        """
+        Allocate the storage.
+
+        Parameters
+        ----------
+        capacity: int
+            Maximum number of samples held
+
+        window: float, optional
+            Time window in seconds limiting the samples returned by view
+
+        columns: int
+            Number of values per sample. Values are stored as rows if more than 1.
+
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+
+        self.capacity = capacity
+        self.window = window
+        self.columns = columns
+
+        self._time = np.zeros(2 * capacity)
+        self._data = np.zeros((2 * capacity, columns) if columns > 1 else 2 * capacity)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, t: float, value: float) -> None:
+        """
+        Add a sample, overwriting the oldest sample if full.
+
+        Parameters
+        ----------
+        t: float
+            Sample time
+
+        value: float or sequence
+            Sample value, or values if the buffer has several columns
+
+        """
+        i = self._next
+        self._time[i] = self._time[i + self.capacity] = t
+        self._data[i] = self._data[i + self.capacity] = value
+
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the held samples, oldest first, limited to the time window if set.
+
+        Returns
+        -------
+        tuple
+            Read-only views of the sample times and values. Views are only valid \\
+            until the next append.
+        """
+        end = self._next + self.capacity
+        start = end - self._size
+
+        if self.window is not None and self._size:
+            cutoff = self._time[end - 1] - self.window
+            start += int(np.searchsorted(self._time[start:end], cutoff))
+
+        times = self._time[start:end]
+        data = self._data[start:end]
+        times.flags.writeable = False
+        data.flags.writeable = False
+
+        return times, data
+
+    def full(self) -> bool:
+        """
+        Whether samples have been overwritten, so the buffer may not hold the whole \\
+        history.
+        """
+        return self._size == self.capacity
+
+    def clear(self) -> None:
+        """
+        Drop all samples.
+        """
+        self._next = 0
+        self._size = 0
+
+
+class BinnedTimeSeries:
+    """
+    Decimated time series aggregating samples into fixed width time bins, each \\
+    holding the minimum, maximum and mean of its samples. Only completed bins are \\
+    returned.
+
+    Attributes
+    ----------
+    bin_width: float
+        Bin width in seconds
+
+    buffer: online_model.app.history.TimeSeriesBuffer
+        Completed bins as (start time, [min, max, mean]) samples
+
+    """
+
+    def __init__(self, bin_width: float, capacity: int) -> None:
+        """
+        Allocate the bin storage.
+
+        Parameters
+        ----------
+        bin_width: float
+            Bin width in seconds
+
+        capacity: int
+            Maximum number of bins held
+
+        """
+        self.bin_width = bin_width
+        self.buffer = TimeSeriesBuffer(capacity, columns=3)
+
+        self._bin = None
+
+    def append(self, t: float, value: float) -> None:
+        """
+        Add a sample to its bin, completing the current bin if the sample falls \\
+        beyond it.
+        """
+        index = int(t // self.bin_width)
+
+        if self._bin is not None and self._bin[0] != index:
+            start, minimum, maximum, total, count = self._bin
+            self.buffer.append(
+                start * self.bin_width, (minimum, maximum, total / count)
+            )
+            self._bin = None
+
+        if self._bin is None:
+            self._bin = [index, value, value, value, 1]
+
+        else:
+            self._bin[1] = min(self._bin[1], value)
+            self._bin[2] = max(self._bin[2], value)
+            self._bin[3] += value
+            self._bin[4] += 1
+
+
+class HistoryPyramid:
+    """
+    Multi-resolution history of a scalar: raw samples plus decimated min/max/mean \\
+    levels of increasing bin width. Long spans are read from coarse levels, so the \\
+    cost of a read depends on the number of points requested rather than the span.
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of samples held by each level
+
+    raw: online_model.app.history.TimeSeriesBuffer
+        Raw samples
+
+    levels: list
+        online_model.app.history.BinnedTimeSeries levels, finest first
+
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_LEVEL_CAPACITY,
+        resolutions: Sequence[float] = DEFAULT_RESOLUTIONS,
+    ) -> None:
+        """
+        Allocate the levels.
+
+        Parameters
+        ----------
+        capacity: int
+            Maximum number of samples held by each level
+
+        resolutions: list
+            Bin widths in seconds of the decimated levels
+
+        """
+        self.capacity = capacity
+        self.raw = TimeSeriesBuffer(capacity)
+        self.levels = [BinnedTimeSeries(width, capacity) for width in resolutions]
+
+    def append(self, t: float, value: float) -> None:
+        """
+        Add a sample to every level.
+        """
+        self.raw.append(t, value)
+        for level in self.levels:
+            level.append(t, value)
+
+    def fetch(
+        self, max_points: int, start: float = None
+    ) -> Tuple[float, Dict[str, np.ndarray]]:
+        """
+        Read the history since start from the finest level covering it with at \\
+        most max_points samples, falling back on the coarsest level.
+
+        Parameters
+        ----------
+        max_points: int
+            Maximum number of points wanted, e.g. the plot width in pixels
+
+        start: float, optional
+            Start of the span, defaults to the whole history
+
+        Returns
+        -------
+        tuple
+            Bin width of the level read (0 for raw samples) and copies of its \\
+            samples as a dictionary of x (time), y (mean), y_min and y_max arrays.
+        """
+        candidates = [(0, self.raw)] + [
+            (level.bin_width, level.buffer) for level in self.levels
+        ]
+
+        # without a match the loop ends on the coarsest level
+        for resolution, buffer in candidates:
+            times, values = buffer.view()
+            first = 0 if start is None else int(np.searchsorted(times, start))
+
+            covered = not buffer.full() or (start is not None and first > 0)
+            if covered and len(times) - first <= max_points:
+                break
+
+        times, values = times[first:], values[first:]
+
+        if resolution == 0:
+            data = dict(x=times.copy(), y=values.copy())
+            data["y_min"] = data["y_max"] = data["y"]
+
+        else:
+            data = dict(
+                x=times.copy(),
+                y=values[:, 2].copy(),
+                y_min=values[:, 0].copy(),
+                y_max=values[:, 1].copy(),
+            )
+
+        return resolution, data
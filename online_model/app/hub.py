@@ -0,0 +1,327 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from online_model.app.controllers import Controller
+from online_model.app.monitors import (
+    PVImage,
+    PVSnapshot,
+    HistoryRecorder,
+    DEFAULT_IMAGE_DATA,
+)
+from online_model import (
+    PREFIX,
+    SIM_PVDB,
+    SNAPSHOT_PV,
+    PROTOCOL,
+    DEFAULT_PV_TIMEOUT,
+    PV_TIMEOUTS,
+    MAX_PUT_RATE,
+)
+
+
+class SharedPVImage(PVImage):
+    """
+    Image monitor read once by the data hub and shared by every session. Polls \\
+    return the last frame read by the hub instead of reading the process variable.
+
+    Attributes
+    ----------
+    frame_id: int
+        Identifier of the held frame, None if unavailable
+
+    """
+
+    def __init__(self, pvname: str, units: str, controller: Controller) -> None:
+        super(SharedPVImage, self).__init__(pvname, units, controller)
+        self.frame_id = None
+        self._frame = DEFAULT_IMAGE_DATA
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """
+        Read the process variable if the server published a new frame. The held \\
+        frame is kept if the new frame is unavailable or not complete yet.
+
+        Returns
+        -------
+        bool
+            Whether a frame was read
+        """
+        frame_id = super(SharedPVImage, self).unique_id()
+        if frame_id is not None and frame_id == self.frame_id:
+            return False
+
+        frame = super(SharedPVImage, self).poll()
+
+        # keep the last good frame and read again on the next refresh
+        if frame is None or frame is DEFAULT_IMAGE_DATA:
+            with self._lock:
+                self.frame_id = None
+
+            return False
+
+        with self._lock:
+            self.frame_id = frame_id
+            self._frame = frame
+
+        return True
+
+    def unique_id(self) -> int:
+        """
+        Returns the identifier of the held frame.
+        """
+        with self._lock:
+            return self.frame_id
+
+    def poll(self) -> Dict[str, list]:
+        """
+        Returns the held frame.
+        """
+        with self._lock:
+            return self._frame
+
+
+class SharedPVSnapshot(PVSnapshot):
+    """
+    Snapshot monitor read once by the data hub and shared by every session. Polls \\
+    return the last snapshot read by the hub instead of reading the process variable.
+    """
+
+    def __init__(self, pvname: str, controller: Controller) -> None:
+        super(SharedPVSnapshot, self).__init__(pvname, controller)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """
+        Read the snapshot process variable.
+
+        Returns
+        -------
+        bool
+            Whether the snapshot holds the outputs of a new evaluation
+        """
+        sequence = self.sequence
+        values = super(SharedPVSnapshot, self).poll()
+
+        with self._lock:
+            self._values = values
+
+        return self.sequence != sequence
+
+    def poll(self) -> Dict[str, float]:
+        """
+        Returns the held snapshot values.
+        """
+        with self._lock:
+            return self._values
+
+
+class DataHub:
+    """
+    Process-wide source of process variable data for the Bokeh sessions. A single \\
+    controller, snapshot monitor, set of image monitors and history recorder are \\
+    polled by a worker thread, and every subscribed session is notified after each \\
+    poll. Server-side traffic is independent of the number of open sessions.
+
+    Each monitor is read on its own executor thread, so a slow or missing process \\
+    variable only delays its own updates, and never blocks the session documents.
+
+    Attributes
+    ----------
+    controller: online_model.app.controllers.Controller
+        Controller shared by the sessions
+
+    period: float
+        Time in seconds between polls
+
+    snapshot_monitor: online_model.app.hub.SharedPVSnapshot
+        Monitor of the aggregate snapshot process variable
+
+    image_monitors: dict
+        Mapping of image process variables to online_model.app.hub.SharedPVImage
+
+    recorder: online_model.app.monitors.HistoryRecorder
+        Recorder of the scalar output histories, sampled on each poll
+
+    """
+
+    def __init__(
+        self,
+        protocol: str,
+        sim_pvdb: dict = SIM_PVDB,
+        period: float = 0.25,
+        timeout: float = DEFAULT_PV_TIMEOUT,
+        timeouts: Dict[str, float] = PV_TIMEOUTS,
+        max_put_rate: float = MAX_PUT_RATE,
+    ) -> None:
+        """
+        Create the controller and the monitors and start polling.
+
+        Parameters
+        ----------
+        protocol: str
+            Protocol to use ("pva", "ca")
+
+        sim_pvdb: dict
+            Dictionary of process variable values
+
+        period: float
+            Time in seconds between polls
+
+        timeout: float
+            Default time in seconds to wait for a process variable
+
+        timeouts: dict
+            Mapping of process variables, without prefix, to timeouts overriding \\
+            the default
+
+        max_put_rate: float
+            Maximum number of queued puts per second to each process variable
+
+        """
+        self.controller = Controller(
+            protocol,
+            timeout=timeout,
+            timeouts={f"{PREFIX}:{pv}": value for pv, value in timeouts.items()},
+            max_put_rate=max_put_rate,
+        )
+        self.period = period
+
+        self.snapshot_monitor = SharedPVSnapshot(
+            f"{PREFIX}:{SNAPSHOT_PV}", self.controller
+        )
+
+        self.image_monitors = {}
+        for opv in sim_pvdb:
+            units = sim_pvdb[opv].get("units", "")
+            if len(units.split(":")) == 2:
+                self.image_monitors[opv] = SharedPVImage(
+                    f"{PREFIX}:{opv}", units, self.controller
+                )
+
+        self.recorder = HistoryRecorder(self.controller, period=period, start=False)
+
+        self._subscribers = {}
+        self._next_token = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        # monitors are filled in the background, sessions start from the defaults
+        monitors = [self.snapshot_monitor] + list(self.image_monitors.values())
+        self._executor = ThreadPoolExecutor(max_workers=len(monitors))
+        self._refreshes = {monitor: None for monitor in monitors}
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def subscribe(self, callback: Callable[[], None]) -> int:
+        """
+        Register a callback run on the hub thread after each poll. Sessions should \\
+        only schedule their document updates from it, e.g. with \\
+        add_next_tick_callback.
+
+        Parameters
+        ----------
+        callback: callable
+            Function called without arguments
+
+        Returns
+        -------
+        int
+            Token to unsubscribe with
+        """
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = callback
+
+        return token
+
+    def unsubscribe(self, token: int) -> None:
+        """
+        Remove a callback, e.g. when its session is destroyed.
+        """
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    def poll(self) -> None:
+        """
+        Start a read of each monitor whose previous read has completed, and sample \\
+        the histories from the latest snapshot.
+        """
+        for monitor, refresh in self._refreshes.items():
+            if refresh is None or refresh.done():
+                self._refreshes[monitor] = self._executor.submit(self._refresh, monitor)
+
+        self.recorder.record(self.snapshot_monitor.poll())
+
+    @staticmethod
+    def _refresh(monitor) -> None:
+        """
+        Executor task reading a monitor.
+        """
+        try:
+            monitor.refresh()
+
+        except Exception as e:
+            print(f"Unable to read {monitor.pvname}")
+            print(e)
+
+    def _run(self) -> None:
+        """
+        Worker loop polling every period and notifying the subscribers.
+        """
+        while not self._stopped.is_set():
+            t = time.time()
+            self.poll()
+
+            with self._lock:
+                callbacks = list(self._subscribers.values())
+
+            for callback in callbacks:
+                try:
+                    callback()
+
+                except Exception as e:
+                    print("Data hub subscriber failed")
+                    print(e)
+
+            self._stopped.wait(max(0.0, self.period - (time.time() - t)))
+
+    def stop(self) -> None:
+        """
+        Stop polling.
+        """
+        self._stopped.set()
+        self._executor.shutdown(wait=False)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub(protocol: str = PROTOCOL) -> DataHub:
+    """
+    Get the data hub of this process, creating it on first use. Bokeh runs the page \\
+    module once per session, while imported modules are shared, so every session \\
+    of the process gets the same hub.
+
+    Parameters
+    ----------
+    protocol: str
+        Protocol to use ("pva", "ca"), only used when creating the hub
+
+    Returns
+    -------
+    online_model.app.hub.DataHub
+    """
+    global _hub
+
+    with _hub_lock:
+        if _hub is None:
+            _hub = DataHub(protocol)
+
+        return _hub
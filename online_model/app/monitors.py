@@ -1,10 +1,17 @@
+import threading
 import time
 
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Sequence, Tuple
 
-from online_model.app.controllers import Controller
-from online_model import PREFIX, ARRAY_PVS
+from online_model.app.controllers import Controller, FrameNotReadyError
+from online_model.app.history import (
+    TimeSeriesBuffer,
+    HistoryPyramid,
+    DEFAULT_LEVEL_CAPACITY,
+    DEFAULT_RESOLUTIONS,
+)
+from online_model import PREFIX, ARRAY_PVS, SNAPSHOT_PV, SNAPSHOT_ORDERING
 
 
 DEFAULT_IMAGE_DATA = {
@@ -17,6 +24,9 @@ DEFAULT_IMAGE_DATA = {
 
 DEFAULT_SCALAR_VALUE = 0
 
+# number of samples held by each time series, one hour of 250 ms polls
+DEFAULT_HISTORY_CAPACITY = 14400
+
 
 class PVImage:
     """
@@ -58,7 +68,9 @@ class PVImage:
         Returns
         -------
         dict
-            Dictionary mapping image components to values.
+            Dictionary mapping image components to values, DEFAULT_IMAGE_DATA if \\
+            the image could not be read, or None if the latest frame is not \\
+            complete yet and should be read again.
         """
 
         try:
@@ -68,9 +80,22 @@ class PVImage:
             print(f"No process variable found for {self.pvname}")
             return DEFAULT_IMAGE_DATA
 
+        except FrameNotReadyError:
+            return None
+
         # now prepare the value using method defined by the model
         return value
 
+    def unique_id(self) -> int:
+        """
+        Returns the identifier of the latest image frame, or None if unavailable.
+        """
+        try:
+            return self.controller.get_image_id(self.pvname)
+
+        except TimeoutError:
+            return None
+
     def variables(self) -> List[str]:
         """
         Returns variables to be plotted. 'x:y' -> ['x', 'y']
@@ -84,16 +109,21 @@ class PVTimeSeries:
 
     Attributes
     ----------
-    tstart:
+    tstart: float
+        Time of monitor creation, samples are timed relative to it
 
-    time: np.ndarray
-        Array of sample times
-
-    data: np.ndarray
-        Array of data samples
+    buffer: online_model.app.history.TimeSeriesBuffer
+        Fixed capacity history of samples
     """
 
-    def __init__(self, pvname: str, units: str, controller: Controller) -> None:
+    def __init__(
+        self,
+        pvname: str,
+        units: str,
+        controller: Controller,
+        capacity: int = DEFAULT_HISTORY_CAPACITY,
+        window: float = None,
+    ) -> None:
         """
         Initializes monitor attributes.
 
@@ -108,17 +138,23 @@ class PVTimeSeries:
         controller: online_model.app.widgets.controllers.Controller
             Controller object for getting pv values
 
+        capacity: int
+            Maximum number of samples held, older samples are dropped
+
+        window: float, optional
+            Only return samples from the last window seconds
+
         """
         self.pvname = pvname
         self.tstart = time.time()
-        self.time = np.array([])
-        self.data = np.array([])
+        self.buffer = TimeSeriesBuffer(capacity, window)
         self.units = units.split(":")
         self.controller = controller
 
     def poll(self) -> Tuple[np.ndarray]:
         """
-        Collects image data via appropriate protocol and returns time and data.
+        Collects image data via appropriate protocol and returns time and data as \
+        views of the history buffer, valid until the next poll.
         """
         t = time.time()
         try:
@@ -126,12 +162,11 @@ class PVTimeSeries:
 
         except TimeoutError:
             print(f"No process variable found for {self.pvname}")
-            v = DEFAULT_SCALAR_VALUE[self.pvname]
+            v = DEFAULT_SCALAR_VALUE
 
-        self.time = np.append(self.time, t)
-        self.data = np.append(self.data, v)
+        self.buffer.append(t - self.tstart, v)
 
-        return self.time - self.tstart, self.data
+        return self.buffer.view()
 
 
 class PVScalar:
@@ -174,3 +209,198 @@ class PVScalar:
             v = DEFAULT_SCALAR_VALUE
 
         return v
+
+
+class PVSnapshot:
+    """
+    Monitor for the aggregate snapshot process variable, holding every scalar \
+    output of one model evaluation.
+
+    Attributes
+    ----------
+    pvname: str
+        Process variable name
+
+    sequence: int
+        Input state sequence number of the last snapshot
+
+    timestamp: float
+        Evaluation time of the last snapshot
+
+    """
+
+    def __init__(self, pvname: str, controller: Controller) -> None:
+        """
+        Initializes monitor attributes.
+
+        Parameters
+        ----------
+        pvname: str
+            Process variable name
+
+        controller: online_model.app.widgets.controllers.Controller
+            Controller object for getting pv values
+
+        """
+        self.pvname = pvname
+        self.controller = controller
+        self.sequence = None
+        self.timestamp = None
+
+    def poll(self) -> Dict[str, float]:
+        """
+        Collects the snapshot with a single get and returns the output values.
+
+        Returns
+        -------
+        dict
+            Mapping of output process variables to values, empty if the snapshot \
+            is unavailable.
+        """
+        try:
+            v = self.controller.get(self.pvname)
+
+        except TimeoutError:
+            v = None
+
+        if v is None:
+            print(f"No process variable found for {self.pvname}")
+            return {}
+
+        self.sequence = int(v[0])
+        self.timestamp = float(v[1])
+
+        return dict(zip(SNAPSHOT_ORDERING, v[2:]))
+
+
+class HistoryRecorder:
+    """
+    Background recorder of the history of every scalar output. The outputs are \\
+    read from the aggregate snapshot process variable on a worker thread and kept \\
+    in multi-resolution histories.
+
+    Attributes
+    ----------
+    tstart: float
+        Time of recorder creation, samples are timed relative to it
+
+    period: float
+        Time in seconds between samples
+
+    histories: dict
+        Mapping of output process variables to online_model.app.history.HistoryPyramid
+
+    """
+
+    def __init__(
+        self,
+        controller: Controller,
+        pvnames: List[str] = SNAPSHOT_ORDERING,
+        period: float = 0.25,
+        capacity: int = DEFAULT_LEVEL_CAPACITY,
+        resolutions: Sequence[float] = DEFAULT_RESOLUTIONS,
+        start: bool = True,
+    ) -> None:
+        """
+        Allocate the histories and start recording.
+
+        Parameters
+        ----------
+        controller: online_model.app.widgets.controllers.Controller
+            Controller object for getting pv values
+
+        pvnames: list
+            Output process variables to record, without prefix
+
+        period: float
+            Time in seconds between samples
+
+        capacity: int
+            Maximum number of samples held by each history level
+
+        resolutions: list
+            Bin widths in seconds of the decimated history levels
+
+        start: bool
+            Start the worker thread. If False, samples are only added by calls to \\
+            poll or record.
+
+        """
+        self.tstart = time.time()
+        self.period = period
+        self.histories = {pv: HistoryPyramid(capacity, resolutions) for pv in pvnames}
+
+        self._snapshot_monitor = PVSnapshot(f"{PREFIX}:{SNAPSHOT_PV}", controller)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self._worker = threading.Thread(target=self._record, daemon=True)
+        if start:
+            self._worker.start()
+
+    def _record(self) -> None:
+        """
+        Worker loop sampling the outputs every period.
+        """
+        while not self._stopped.is_set():
+            t = time.time()
+            self.poll()
+            self._stopped.wait(max(0.0, self.period - (time.time() - t)))
+
+    def poll(self) -> None:
+        """
+        Read the snapshot and add a sample to each history.
+        """
+        self.record(self._snapshot_monitor.poll())
+
+    def record(self, snapshot: Dict[str, float]) -> None:
+        """
+        Add a sample to each history from snapshot values read elsewhere.
+
+        Parameters
+        ----------
+        snapshot: dict
+            Mapping of output process variables to values
+
+        """
+        t = time.time() - self.tstart
+
+        with self._lock:
+            for pv, history in self.histories.items():
+                if pv in snapshot:
+                    history.append(t, snapshot[pv])
+
+    def fetch(
+        self, pvname: str, max_points: int, window: float = None
+    ) -> Tuple[float, Dict[str, np.ndarray]]:
+        """
+        Read the history of an output at the finest resolution holding at most \\
+        max_points samples.
+
+        Parameters
+        ----------
+        pvname: str
+            Output process variable, without prefix
+
+        max_points: int
+            Maximum number of points wanted, e.g. the plot width in pixels
+
+        window: float, optional
+            Span in seconds to read, defaults to the whole history
+
+        Returns
+        -------
+        tuple
+            Bin width of the resolution read (0 for raw samples) and a dictionary \\
+            of x (time), y (mean), y_min and y_max arrays.
+        """
+        start = None if window is None else time.time() - self.tstart - window
+
+        with self._lock:
+            return self.histories[pvname].fetch(max_points, start)
+
+    def stop(self) -> None:
+        """
+        Stop recording.
+        """
+        self._stopped.set()
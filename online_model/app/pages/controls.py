@@ -9,14 +9,14 @@ from bokeh.layouts import column, row
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../..")
 
 from online_model.app.widgets.sliders import build_sliders
-from online_model.app.controllers import Controller
-from online_model import CMD_PVDB, PROTOCOL
+from online_model.app.hub import get_hub
+from online_model import CMD_PVDB, PROTOCOL, THROTTLE_SLIDERS
 
-# create controller
-controller = Controller(PROTOCOL)
+# use the controller shared by the sessions of this process
+controller = get_hub(PROTOCOL).controller
 
 # build sliders for the command process variable database
-sliders = build_sliders(CMD_PVDB, controller)
+sliders = build_sliders(CMD_PVDB, controller, throttled=THROTTLE_SLIDERS)
 scol = column(sliders, width=350)
 
 curdoc().add_root(row(scol))
@@ -10,11 +10,18 @@ from bokeh import palettes
 # fix for bokeh path error, maybe theres a better way to do this
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../..")
 
-from online_model.app.controllers import Controller
+from online_model.app.hub import get_hub
 from online_model.app.widgets.sliders import build_sliders
 from online_model.app.widgets.plots import ImagePlot, Striptool
 from online_model.app.widgets.tables import ValueTable
-from online_model import PREFIX, SIM_PVDB, CMD_PVDB, EXCLUDE_SLIDERS, PROTOCOL
+from online_model import (
+    PREFIX,
+    SIM_PVDB,
+    CMD_PVDB,
+    EXCLUDE_SLIDERS,
+    PROTOCOL,
+    THROTTLE_SLIDERS,
+)
 
 
 # exclude channel access data items from plots
@@ -22,8 +29,10 @@ PLOT_PVDB = {
     item: value for item, value in SIM_PVDB.items() if "units" in SIM_PVDB[item]
 }
 
-# create controller
-controller = Controller(PROTOCOL)
+# data hub shared by the sessions of this process
+hub = get_hub(PROTOCOL)
+controller = hub.controller
+doc = curdoc()
 
 # Create custom palette with low values set to white
 pal = list(palettes.viridis(244))  # 256 - 12 (set lowest 5% to white)
@@ -31,7 +40,7 @@ pal = ["#FFFFFF"] * 12 + pal
 pal = tuple(pal)
 
 # set up plot
-image_plot = ImagePlot(PLOT_PVDB, controller)
+image_plot = ImagePlot(PLOT_PVDB, controller, hub=hub)
 image_plot.build_plot(pal)
 
 # set current_pv globally
@@ -71,11 +80,11 @@ for var, value in CMD_PVDB.items():
     if "in_" not in var:
         sliders_to_render[var] = value
 
-sliders = build_sliders(CMD_PVDB, controller)
+sliders = build_sliders(CMD_PVDB, controller, throttled=THROTTLE_SLIDERS)
 slider_col = column(sliders, width=350)
 
 # Set up the striptool
-striptool = Striptool(PLOT_PVDB, controller)
+striptool = Striptool(PLOT_PVDB, controller, recorder=hub.recorder)
 striptool.build_plot()
 
 # set up global pv
@@ -90,7 +99,7 @@ def striptool_select_callback(attr, old, new):
 striptool_select = Select(
     title="PV to Plot:",
     value=current_striptool_pv,
-    options=list(striptool.pv_monitors.keys()),
+    options=list(striptool.units.keys()),
 )
 
 striptool_select.on_change("value", striptool_select_callback)
@@ -105,7 +114,7 @@ def striptool_update_callback():
 
 
 # add table
-value_table = ValueTable(PLOT_PVDB, controller)
+value_table = ValueTable(PLOT_PVDB, controller, hub=hub)
 
 # Set up table update callback
 def table_update_callback():
@@ -115,10 +124,30 @@ def table_update_callback():
     value_table.update()
 
 
+# Set up hub notification callback
+def hub_callback():
+    """
+    Schedules the page updates on the session document after each hub poll.
+    """
+    doc.add_next_tick_callback(image_update_callback)
+    doc.add_next_tick_callback(striptool_update_callback)
+    doc.add_next_tick_callback(table_update_callback)
+
+
+hub_token = hub.subscribe(hub_callback)
+
+
+def session_destroyed_callback(session_context):
+    """
+    Stops the hub notifications of a closed session.
+    """
+    hub.unsubscribe(hub_token)
+
+
 # Set up the document
-curdoc().title = "Online Surrogate Model Virtual Machine"
+doc.title = "Online Surrogate Model Virtual Machine"
 
-curdoc().add_root(
+doc.add_root(
     column(
         row(slider_col, Spacer(width=50), value_table.table),  # add sliders
         row(
@@ -129,6 +158,4 @@ curdoc().add_root(
     )
 )
 
-curdoc().add_periodic_callback(image_update_callback, 250)
-curdoc().add_periodic_callback(striptool_update_callback, 250)
-curdoc().add_periodic_callback(table_update_callback, 250)
+doc.on_session_destroyed(session_destroyed_callback)
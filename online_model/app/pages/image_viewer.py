@@ -11,7 +11,7 @@ from bokeh import palettes
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../..")
 
 from online_model import PREFIX, SIM_PVDB, PROTOCOL
-from online_model.app.controllers import Controller
+from online_model.app.hub import get_hub
 from online_model.app.widgets.plots import ImagePlot
 
 # exclude channel access data items from plots
@@ -19,8 +19,10 @@ PLOT_PVDB = {
     item: value for item, value in SIM_PVDB.items() if "units" in SIM_PVDB[item]
 }
 
-# create controller
-controller = Controller(PROTOCOL)
+# data hub shared by the sessions of this process
+hub = get_hub(PROTOCOL)
+controller = hub.controller
+doc = curdoc()
 
 # Create custom palette with low values set to white
 pal = list(palettes.viridis(244))  # 256 - 12 (set lowest 5% to white)
@@ -28,7 +30,7 @@ pal = ["#FFFFFF"] * 12 + pal
 pal = tuple(pal)
 
 # set up plot
-image_plot = ImagePlot(PLOT_PVDB, controller)
+image_plot = ImagePlot(PLOT_PVDB, controller, hub=hub)
 image_plot.build_plot(pal)
 
 # set current_pv globally
@@ -59,6 +61,24 @@ def image_callback():
     image_plot.update(current_pv)
 
 
-curdoc().title = "Online Surrogate Model Image Viewer"
-curdoc().add_root(column(row(select), row(image_plot.p), width=300))
-curdoc().add_periodic_callback(image_callback, 250)
+# Set up hub notification callback
+def hub_callback():
+    """
+    Schedules the image update on the session document after each hub poll.
+    """
+    doc.add_next_tick_callback(image_callback)
+
+
+hub_token = hub.subscribe(hub_callback)
+
+
+def session_destroyed_callback(session_context):
+    """
+    Stops the hub notifications of a closed session.
+    """
+    hub.unsubscribe(hub_token)
+
+
+doc.title = "Online Surrogate Model Image Viewer"
+doc.add_root(column(row(select), row(image_plot.p), width=300))
+doc.on_session_destroyed(session_destroyed_callback)
@@ -8,7 +8,7 @@ from bokeh.models.widgets import Select
 # fix for bokeh path error, maybe theres a better way to do this
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../..")
 
-from online_model.app.controllers import Controller
+from online_model.app.hub import get_hub
 from online_model.app.widgets.plots import Striptool
 from online_model import SIM_PVDB, PROTOCOL
 
@@ -17,17 +17,19 @@ PLOT_PVDB = {
     item: value for item, value in SIM_PVDB.items() if "units" in SIM_PVDB[item]
 }
 
-# create controller
-controller = Controller(PROTOCOL)
+# data hub shared by the sessions of this process
+hub = get_hub(PROTOCOL)
+controller = hub.controller
+doc = curdoc()
 
 # Set up the controller for the plot
-striptool = Striptool(PLOT_PVDB, controller)
+striptool = Striptool(PLOT_PVDB, controller, recorder=hub.recorder)
 striptool.build_plot()
 current_pv = striptool.current_pv
 
 # Set up select option
 select = Select(
-    title="PV to Plot:", value=current_pv, options=list(striptool.pv_monitors.keys())
+    title="PV to Plot:", value=current_pv, options=list(striptool.units.keys())
 )
 
 # Set up selection callback
@@ -50,7 +52,25 @@ def plot_callback():
     striptool.update(current_pv)
 
 
+# Set up hub notification callback
+def hub_callback():
+    """
+    Schedules the plot update on the session document after each hub poll.
+    """
+    doc.add_next_tick_callback(plot_callback)
+
+
+hub_token = hub.subscribe(hub_callback)
+
+
+def session_destroyed_callback(session_context):
+    """
+    Stops the hub notifications of a closed session.
+    """
+    hub.unsubscribe(hub_token)
+
+
 # Set up page
-curdoc().title = "Online Surrogate Model Strip Tool"
-curdoc().add_root(column(row(select), row(striptool.p), width=300))
-curdoc().add_periodic_callback(plot_callback, 250)
+doc.title = "Online Surrogate Model Strip Tool"
+doc.add_root(column(row(select), row(striptool.p), width=300))
+doc.on_session_destroyed(session_destroyed_callback)
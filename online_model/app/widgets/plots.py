@@ -1,11 +1,12 @@
 from typing import List
 
+import numpy as np
 from bokeh.plotting import figure
 from bokeh.models import ColumnDataSource
 
 from online_model.app.controllers import Controller
-from online_model.app.monitors import PVImage, PVTimeSeries
-from online_model import PREFIX, ARRAY_PVS
+from online_model.app.monitors import PVImage, HistoryRecorder, DEFAULT_IMAGE_DATA
+from online_model import PREFIX, ARRAY_PVS, SNAPSHOT_ORDERING
 
 
 class ImagePlot:
@@ -17,6 +18,9 @@ class ImagePlot:
     current_pv: str
         Current process variable to be displayed
 
+    image_id: int
+        Identifier of the displayed image frame
+
     source: bokeh.models.sources.ColumnDataSource
         Data source for the viewer.
 
@@ -31,7 +35,7 @@ class ImagePlot:
 
     """
 
-    def __init__(self, sim_pvdb: dict, controller: Controller) -> None:
+    def __init__(self, sim_pvdb: dict, controller: Controller, hub=None) -> None:
         """
         Initialize monitors, current process variable, and data source.
 
@@ -43,17 +47,29 @@ class ImagePlot:
         controller: online_model.app.widgets.controllers.Controller
             Controller object for getting pv values
 
+        hub: online_model.app.hub.DataHub, optional
+            Data hub sharing its image monitors, which are read once per process
+
         """
         self.pv_monitors = {}
 
         for opv in sim_pvdb:
-            if len(sim_pvdb[opv]["units"].split(":")) == 2:
+            if hub is not None and opv in hub.image_monitors:
+                self.pv_monitors[opv] = hub.image_monitors[opv]
+
+            elif len(sim_pvdb[opv]["units"].split(":")) == 2:
                 self.pv_monitors[opv] = PVImage(
                     f"{PREFIX}:{opv}", sim_pvdb[opv]["units"], controller
                 )
 
         self.current_pv = list(self.pv_monitors.keys())[0]
+        self.image_id = self.pv_monitors[self.current_pv].unique_id()
         image_data = self.pv_monitors[self.current_pv].poll()
+
+        if image_data is None:
+            self.image_id = None
+            image_data = DEFAULT_IMAGE_DATA
+
         self.source = ColumnDataSource(image_data)
 
     def build_plot(self, palette: tuple) -> None:
@@ -92,26 +108,50 @@ class ImagePlot:
 
     def update(self, current_pv: str) -> None:
         """
-        Update the plot to reflect current process variable.
+        Update the plot to reflect current process variable. The image is only sent \\
+        to the browser if the server published a new frame since the last update, \\
+        and the displayed frame is kept if the new frame cannot be read yet.
 
         Parameters
         ----------
         current_pv: str
             Current process variable
         """
-        # update internal pv trackinng
-        self.current_pv = current_pv
+        pv_changed = current_pv != self.current_pv
 
-        # Update x and y axes
-        variables = self.pv_monitors[current_pv].variables()
-        units = self.pv_monitors[current_pv].units
+        if pv_changed:
+            # update internal pv trackinng
+            self.current_pv = current_pv
+            self.image_id = None
 
-        self.p.xaxis.axis_label = variables[-2] + " (" + units[0] + ")"
-        self.p.yaxis.axis_label = variables[-1] + " (" + units[1] + ")"
+            # Update x and y axes
+            variables = self.pv_monitors[current_pv].variables()
+            units = self.pv_monitors[current_pv].units
+
+            self.p.xaxis.axis_label = variables[-2] + " (" + units[0] + ")"
+            self.p.yaxis.axis_label = variables[-1] + " (" + units[1] + ")"
+
+        # skip frames already displayed, always polling if the id is unavailable
+        image_id = self.pv_monitors[current_pv].unique_id()
+        if image_id is not None and image_id == self.image_id:
+            return
 
         # get image data
         image_data = self.pv_monitors[current_pv].poll()
 
+        # keep the displayed frame and poll again on the next update if the frame was
+        # unavailable, unless it belongs to the previous process variable
+        if image_data is None or image_data is DEFAULT_IMAGE_DATA:
+            self.image_id = None
+
+            if not pv_changed:
+                return
+
+            image_data = DEFAULT_IMAGE_DATA
+
+        else:
+            self.image_id = image_id
+
         # update data source
         self.img_obj.data_source.data.update(image_data)
 
@@ -128,8 +168,20 @@ class Striptool:
     source: bokeh.models.sources.ColumnDataSource
         Data source for the viewer.
 
-    pv_monitors: PVScalarMonitor
-        Monitors for the scalar variables.
+    recorder: online_model.app.monitors.HistoryRecorder
+        Recorder of the scalar variable histories.
+
+    units: dict
+        Mapping of the plotted process variables to their units
+
+    window: float
+        Span in seconds to display, the whole history if None
+
+    resolution: float
+        Bin width of the displayed history, 0 for raw samples
+
+    rollover: int
+        Maximum number of displayed points kept when streaming new samples
 
     p: bokeh.plotting.figure.Figure
         Plot object
@@ -137,10 +189,15 @@ class Striptool:
     """
 
     def __init__(
-        self, sim_pvdb: dict, controller: Controller, array_pvs: List[str] = ARRAY_PVS
+        self,
+        sim_pvdb: dict,
+        controller: Controller,
+        array_pvs: List[str] = ARRAY_PVS,
+        recorder: HistoryRecorder = None,
+        window: float = None,
     ) -> None:
         """
-        Initialize monitors, current process variable, and data source.
+        Initialize the history recorder, current process variable, and data source.
 
         Parameters
         ----------
@@ -153,47 +210,88 @@ class Striptool:
         array_pvs: list
             List of pvs to be excluded due to image formatting etc.
 
+        recorder: online_model.app.monitors.HistoryRecorder, optional
+            Recorder to read histories from. One is started if not given.
+
+        window: float, optional
+            Span in seconds to display, defaults to the whole history
+
         Notes
         -----
         The array_pvs is kind of a hacky fix that should be fixed and accounted for
         when stronger parameter type definitions are implemented.
 
         """
-        self.pv_monitors = {}
-
-        # only creating pvs for non-image pvs
+        # only plotting scalar outputs, which are all recorded
+        self.units = {}
         for opv in sim_pvdb:
-            if opv not in array_pvs:
-                self.pv_monitors[opv] = PVTimeSeries(
-                    f"{PREFIX}:{opv}", sim_pvdb[opv]["units"], controller
-                )
+            if opv not in array_pvs and opv in SNAPSHOT_ORDERING:
+                self.units[opv] = sim_pvdb[opv]["units"].split(":")
 
-        self.current_pv = list(self.pv_monitors.keys())[0]
-        ts, ys = self.pv_monitors[self.current_pv].poll()
-        self.source = ColumnDataSource(dict(x=ts, y=ys))
+        self.recorder = recorder
+        if self.recorder is None:
+            self.recorder = HistoryRecorder(controller, list(self.units))
+
+        self.window = window
+        self.current_pv = list(self.units.keys())[0]
+        self.resolution = None
+        self.rollover = None
+        self.source = ColumnDataSource(dict(x=[], y=[], y_min=[], y_max=[]))
 
     def build_plot(self) -> None:
         """
         Creates the plot object.
         """
         self.p = figure(plot_width=400, plot_height=400)
+        self.p.varea(x="x", y1="y_min", y2="y_max", fill_alpha=0.3, source=self.source)
         self.p.line(x="x", y="y", line_width=2, source=self.source)
         self.p.yaxis.axis_label = (
-            self.current_pv + " (" + self.pv_monitors[self.current_pv].units[0] + ")"
+            self.current_pv + " (" + self.units[self.current_pv][0] + ")"
         )
         self.p.xaxis.axis_label = "time (sec)"
 
     def update(self, current_pv: str) -> None:
         """
-        Update the plot to reflect current process variable.
+        Update the plot to reflect current process variable. The history is read at \\
+        the resolution matching the plot width, drawing the mean with a min/max \\
+        band. Only new samples are streamed to the browser; the full history is \\
+        only sent when the process variable or the resolution changes.
 
         Parameters
         ----------
         current_pv: str
             Current process variable
         """
-        self.current_pv = current_pv
-        ts, ys = self.pv_monitors[current_pv].poll()
-        units = self.pv_monitors[current_pv].units[0]
-        self.source.data = dict(x=ts, y=ys)
-        self.p.yaxis.axis_label = f"{current_pv} ({units})"
+        resolution, data = self.recorder.fetch(
+            current_pv, self.p.plot_width, self.window
+        )
+
+        if current_pv == self.current_pv and resolution == self.resolution:
+            shown = self.source.data["x"]
+            last = shown[-1] if len(shown) else -np.inf
+            new = data["x"] > last
+
+            if new.any():
+                self.source.stream(
+                    {column: values[new] for column, values in data.items()},
+                    rollover=self.rollover,
+                )
+
+            return
+
+        self.resolution = resolution
+        self.source.data = data
+
+        # the displayed level may hold more points than the plot width, e.g. when
+        # falling back on the coarsest level; keep as many points as the recorder
+        # holds, or as fall in the window
+        if self.window is None:
+            self.rollover = self.recorder.histories[current_pv].capacity
+
+        else:
+            self.rollover = max(len(data["x"]), self.p.plot_width)
+
+        if current_pv != self.current_pv:
+            self.current_pv = current_pv
+            units = self.units[current_pv][0]
+            self.p.yaxis.axis_label = f"{current_pv} ({units})"
@@ -16,7 +16,8 @@ def set_pv_from_slider(
     controller: Controller,
 ) -> None:
     """
-    Callback function for slider change.
+    Callback function for slider change. The value is put through the controller \\
+    put queue, so the callback never waits for the server.
 
     Parameters
     ----------
@@ -40,11 +41,20 @@ def set_pv_from_slider(
         Controller object for getting pv values
 
     """
-    controller.put(pvname, new * scale)
+    controller.queue_put(pvname, new * scale)
 
 
 def build_slider(
-    title: str, pvname, scale, start, end, step, controller, server="bokeh"
+    title: str,
+    pvname,
+    scale,
+    start,
+    end,
+    step,
+    controller,
+    server="bokeh",
+    value: float = None,
+    throttled: bool = False,
 ) -> Slider:
     """
     Utility function for building a slider.
@@ -72,6 +82,13 @@ def build_slider(
     controller: online_model.app.widgets.controllers.Controller
         Controller object for getting pv values
 
+    value: float, optional
+        Current value of the process variable, read with the controller if omitted
+
+    throttled: bool
+        Only put the value once dragging ends, if supported by the Bokeh version. \\
+        Otherwise intermediate values are put at the controller put rate.
+
     Returns
     -------
     bokeh.models.widgets.sliders.Slider
@@ -79,10 +96,15 @@ def build_slider(
     """
 
     # initialize value
-    try:
-        start_val = controller.get(pvname)
+    start_val = value
+    if start_val is None:
+        try:
+            start_val = controller.get(pvname)
+
+        except TimeoutError:
+            start_val = None
 
-    except TimeoutError:
+    if start_val is None:
         print(f"No process variable found for {pvname}")
         start_val = 0
 
@@ -91,15 +113,21 @@ def build_slider(
     )
 
     # set up callback
+    attr = "value"
+    if throttled and "value_throttled" in slider.properties():
+        attr = "value_throttled"
+
     slider.on_change(
-        "value",
+        attr,
         partial(set_pv_from_slider, pvname=pvname, scale=scale, controller=controller),
     )
 
     return slider
 
 
-def build_sliders(cmd_pvdb: dict, controller: Controller) -> List[Slider]:
+def build_sliders(
+    cmd_pvdb: dict, controller: Controller, throttled: bool = False
+) -> List[Slider]:
     """
     Build sliders from the cmd_pvdb.
 
@@ -107,6 +135,9 @@ def build_sliders(cmd_pvdb: dict, controller: Controller) -> List[Slider]:
     ----------
     cmd_pvdb: dict
 
+    throttled: bool
+        Only put slider values once dragging ends
+
     Return
     ------
     list
@@ -119,22 +150,29 @@ def build_sliders(cmd_pvdb: dict, controller: Controller) -> List[Slider]:
     """
     sliders = []
 
-    for ii, pv in enumerate(cmd_pvdb):
-        if pv not in EXCLUDE_SLIDERS:  # temporarily exclude the extent sliders
-            title = pv + " (" + cmd_pvdb[pv]["units"] + ")"
-            pvname = PREFIX + ":" + pv
-            step = (cmd_pvdb[pv]["range"][1] - cmd_pvdb[pv]["range"][0]) / 100.0
-            scale = 1
-
-            slider = build_slider(
-                title,
-                pvname,
-                scale,
-                cmd_pvdb[pv]["range"][0],
-                cmd_pvdb[pv]["range"][1],
-                step,
-                controller,
-            )
-            sliders.append(slider)
+    # temporarily exclude the extent sliders
+    slider_pvs = [pv for pv in cmd_pvdb if pv not in EXCLUDE_SLIDERS]
+
+    # read all starting values at once
+    values = controller.get_many([PREFIX + ":" + pv for pv in slider_pvs])
+
+    for pv, value in zip(slider_pvs, values):
+        title = pv + " (" + cmd_pvdb[pv]["units"] + ")"
+        pvname = PREFIX + ":" + pv
+        step = (cmd_pvdb[pv]["range"][1] - cmd_pvdb[pv]["range"][0]) / 100.0
+        scale = 1
+
+        slider = build_slider(
+            title,
+            pvname,
+            scale,
+            cmd_pvdb[pv]["range"][0],
+            cmd_pvdb[pv]["range"][1],
+            step,
+            controller,
+            value=value,
+            throttled=throttled,
+        )
+        sliders.append(slider)
 
     return sliders
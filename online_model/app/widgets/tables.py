@@ -3,16 +3,22 @@ from typing import List
 from bokeh.models import ColumnDataSource, DataTable, TableColumn, StringFormatter
 
 from online_model.app.controllers import Controller
-from online_model.app.monitors import PVScalar
-from online_model import PREFIX, ARRAY_PVS
+from online_model.app.monitors import PVSnapshot, DEFAULT_SCALAR_VALUE
+from online_model import PREFIX, ARRAY_PVS, SNAPSHOT_PV, SNAPSHOT_ORDERING
 
 
 class ValueTable:
     def __init__(
-        self, sim_pvdb, controller: Controller, array_pvs: List[str] = ARRAY_PVS
+        self,
+        sim_pvdb,
+        controller: Controller,
+        array_pvs: List[str] = ARRAY_PVS,
+        hub=None,
     ) -> None:
         """
-        View for value table item. Maps process variable name to its value.
+        View for value table item. Maps process variable name to its value. All \
+        values are read with a single get of the aggregate snapshot process \
+        variable, so the table always shows the outputs of one model evaluation.
 
         Parameters
         ----------
@@ -25,31 +31,34 @@ class ValueTable:
         array_pvs: list
             List of pvs to be excluded due to image formatting etc.
 
+        hub: online_model.app.hub.DataHub, optional
+            Data hub sharing its snapshot monitor, which is read once per process
+
         Notes
         -----
         The array_pvs is kind of a hacky fix that should be fixed and accounted for
         when stronger parameter type definitions are implemented.
 
         """
-        # only creating pvs for non-image pvs
-        self.pv_monitors = {}
-        self.output_values = []
+        if hub is not None:
+            self.snapshot_monitor = hub.snapshot_monitor
+
+        else:
+            self.snapshot_monitor = PVSnapshot(f"{PREFIX}:{SNAPSHOT_PV}", controller)
+
         self.names = []
 
         # be sure to surface units in the table
         self.unit_map = {}
 
+        # image data pvs are not part of the snapshot
         for pv in sim_pvdb:
-            if pv not in array_pvs:
-                self.pv_monitors[pv] = PVScalar(
-                    f"{PREFIX}:{pv}", sim_pvdb[pv]["units"], controller
-                )
-                v = self.pv_monitors[pv].poll()
-
-                self.output_values.append(v)
+            if pv not in array_pvs and pv in SNAPSHOT_ORDERING:
                 self.names.append(pv)
                 self.unit_map[pv] = sim_pvdb[pv]["units"]
 
+        self.output_values = self.poll()
+
         self.create_table()
 
     def create_table(self) -> None:
@@ -69,13 +78,17 @@ class ValueTable:
             source=self.source, columns=columns, width=400, height=280
         )
 
+    def poll(self) -> List[float]:
+        """
+        Collect the output values from the snapshot, in table order.
+        """
+        snapshot = self.snapshot_monitor.poll()
+        return [snapshot.get(pv, DEFAULT_SCALAR_VALUE) for pv in self.names]
+
     def update(self):
         """
         Update data source.
         """
-        output_values = []
-        for pv in self.pv_monitors:
-            v = self.pv_monitors[pv].poll()
-            output_values.append(v)
+        output_values = self.poll()
 
         self.source.data = dict(x=self.names, y=output_values)
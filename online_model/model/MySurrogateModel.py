@@ -6,6 +6,7 @@ import tensorflow as tf
 from tensorflow import keras
 
 from online_model.model.surrogate_model import SurrogateModel
+from online_model.model.cache import LRUCache, image_fingerprint
 from online_model.model import (
     apply_temporary_ordering_patch,
     format_outputs_by_protocol,
@@ -18,10 +19,16 @@ Example Usage:
     Load model and use a dictionary of inputs to evaluate the NN.
     """
 
-    def __init__(self, model_file=None, stock_image_input=None):
+    # batches up to this size bypass keras Model.predict and call the session directly
+    direct_call_max_rows = 32
+
+    def __init__(
+        self, model_file=None, stock_image_input=None, embedding_cache_size=16
+    ):
         # Save init
         self.model_file = model_file
         self.stock_image_input = stock_image_input
+        self.embedding_cache_size = embedding_cache_size
         # Run control
         self.configure()
 
@@ -46,12 +53,16 @@ Example Usage:
 
         # load model in thread safe manner
         self.thread_graph = tf.Graph()
-        with self.thread_graph.as_default():
+        self.session = tf.compat.v1.Session(graph=self.thread_graph)
+        with self.thread_graph.as_default(), self.session.as_default():
             self.model = tf.keras.models.model_from_json(
                 self.json_string.decode("utf-8")
             )
             self.model.load_weights(self.model_file)
 
+            # split off the image branch so its output can be cached per image
+            self.image_encoder, self.head_model = self.split_image_branch()
+
         # TEMPORARY PATCH FOR INPUT/OUTPUT REDUNDANT VARS
         self.input_ordering = apply_temporary_ordering_patch(self.input_ordering, "in")
         self.output_ordering = apply_temporary_ordering_patch(
@@ -76,6 +87,70 @@ Example Usage:
             self.scalar_variables = len(self.input_ordering)
             self.scalar_outputs = len(self.output_ordering)
 
+        self.embedding_cache = LRUCache(self.embedding_cache_size)
+        self.build_inference_functions()
+
+    def build_inference_functions(self):
+        """
+        Builds the session callables used for interactive inference and warms them \\
+        up with the stock image input, so the fixed input signature is traced once \\
+        here rather than on the first request.
+        """
+        with self.thread_graph.as_default(), self.session.as_default():
+            if self.head_model is not None:
+                self.encoder_function = keras.backend.function(
+                    self.image_encoder.inputs, self.image_encoder.outputs
+                )
+                self.inference_function = keras.backend.function(
+                    self.head_model.inputs, self.head_model.outputs
+                )
+
+            else:
+                self.encoder_function = None
+                self.inference_function = keras.backend.function(
+                    self.model.inputs, self.model.outputs
+                )
+
+        if self.type == "both" and self.stock_image_input is not None:
+            self.evaluate(
+                np.array([self.stock_image_input]),
+                np.array([self.input_offsets[0 : self.scalar_variables]]),
+            )
+
+    def call_model(self, model, function, model_inputs):
+        """
+        Runs a model on a list of input arrays. Small batches are passed straight to \\
+        the prebuilt session callable, avoiding the per-call setup of keras \\
+        Model.predict, while large batches go through Model.predict.
+
+        Parameters
+        ----------
+        model: tf.keras.Model
+            Model to run
+
+        function:
+            Session callable built from the model inputs and outputs
+
+        model_inputs: list
+            Input arrays in model input order
+
+        Returns
+        -------
+        list
+            Output arrays in model output order
+        """
+        # call prediction in threadsafe manner
+        with self.thread_graph.as_default(), self.session.as_default():
+            if len(model_inputs[0]) <= self.direct_call_max_rows:
+                return function(model_inputs)
+
+            predicted_output = model.predict(model_inputs)
+
+        if len(model.outputs) == 1:
+            return [predicted_output]
+
+        return predicted_output
+
     def scale_inputs(self, input_values):
         data_scaled = self.model_value_min + (
             (input_values - self.input_offsets[0 : self.scalar_variables])
@@ -126,7 +201,7 @@ Example Usage:
             vec = np.array([[settings[key] for key in self.input_ordering]])
             inputs_scaled = self.scale_inputs(vec)
             model_output = self.model.predict(inputs_scaled)
-            model_output = self.unscale_outputs(predicted_outputs)
+            model_output = self.unscale_outputs(model_output)
             output = dict(zip(self.output_ordering, model_output.T))
 
         return output
@@ -135,16 +210,94 @@ Example Usage:
         if not "image" in settings:
             settings["image"] = self.stock_image_input
 
-        vec = np.array([settings[key] for key in self.input_ordering])
+        vec = np.array([[settings[key] for key in self.input_ordering]])
         image = np.array([settings["image"]])
 
-        inputs_scalar_scaled = self.scale_inputs([vec])
-        inputs_image_scaled = self.scale_image(image)
+        (
+            predicted_image_unscaled,
+            predicted_scalars_unscaled,
+            predicted_extents,
+        ) = self.evaluate(image, vec)
 
-        # call prediction in threadsafe manner
-        with self.thread_graph.as_default():
-            predicted_output = self.model.predict(
-                [inputs_image_scaled, inputs_scalar_scaled]
+        predicted_output = dict(zip(self.output_ordering, predicted_scalars_unscaled.T))
+        predicted_output["extents"] = predicted_extents
+        predicted_output["image"] = predicted_image_unscaled
+
+        return self.prepare_outputs(predicted_output)
+
+    def predict_batch(self, inputs, images=None):
+        """
+        Evaluates the model for N input settings using a single model call.
+
+        Parameters
+        ----------
+        inputs: np.ndarray or list
+            Either a 2-D array of shape (N, len(input_ordering)) with columns in \\
+            input_ordering order, or a list of N settings dictionaries.
+
+        images: np.ndarray, optional
+            Either a single image used for every row or a stack of N images. When \\
+            omitted, the "image" entries of the settings dictionaries are used, \\
+            falling back on the stock image input.
+
+        Returns
+        -------
+        dict
+            Columnar outputs mapping each scalar output to an array of N values, \\
+            "x:y" to an (N, bins[0], bins[1]) image stack and "x:y:dw", "x:y:dh" to \\
+            arrays of N image extents.
+        """
+        vec, image = self.stack_inputs(inputs, images)
+
+        (
+            predicted_image_unscaled,
+            predicted_scalars_unscaled,
+            predicted_extents,
+        ) = self.evaluate(image, vec)
+
+        output = dict(zip(self.output_ordering, predicted_scalars_unscaled.T))
+        output["x:y"] = predicted_image_unscaled.reshape(
+            (-1, int(self.bins[0]), int(self.bins[1]))
+        )
+        output["x:y:dw"] = predicted_extents[:, 1] - predicted_extents[:, 0]
+        output["x:y:dh"] = predicted_extents[:, 3] - predicted_extents[:, 2]
+
+        return output
+
+    def evaluate(self, images, vec):
+        """
+        Scales the inputs, runs the model and unscales the outputs. If the image \\
+        branch has been split off, image embeddings are taken from the embedding \\
+        cache and only the head is run on the scalar inputs.
+
+        Parameters
+        ----------
+        images: np.ndarray
+            Unscaled image stack with a leading axis of length N
+
+        vec: np.ndarray
+            Unscaled scalar inputs of shape (N, len(input_ordering))
+
+        Returns
+        -------
+        tuple
+            Unscaled flattened images of shape (N, bins[0] * bins[1]), unscaled \\
+            scalar outputs of shape (N, len(output_ordering)) and image extents.
+        """
+        inputs_scalar_scaled = self.scale_inputs(vec)
+
+        if self.head_model is not None:
+            predicted_output = self.call_model(
+                self.head_model,
+                self.inference_function,
+                [self.encode_images(images), inputs_scalar_scaled],
+            )
+
+        else:
+            predicted_output = self.call_model(
+                self.model,
+                self.inference_function,
+                [self.scale_image(images), inputs_scalar_scaled],
             )
 
         predicted_image_scaled = np.array(predicted_output[0])
@@ -159,14 +312,130 @@ Example Usage:
             )
         )
 
-        predicted_output = dict(zip(self.output_ordering, predicted_scalars_unscaled.T))
-        predicted_image = predicted_image_unscaled.reshape(
-            (int(self.bins[0]), int(self.bins[1]))
+        return predicted_image_unscaled, predicted_scalars_unscaled, predicted_extents
+
+    def encode_images(self, images):
+        """
+        Returns the image branch output for each image, running the image encoder \\
+        only for images not found in the embedding cache.
+
+        Parameters
+        ----------
+        images: np.ndarray
+            Unscaled image stack with a leading axis of length N
+
+        Returns
+        -------
+        np.ndarray
+            Stack of N image embeddings
+        """
+        # a broadcast stack repeats one image, so only fingerprint it once
+        if images.shape[0] > 1 and images.strides[0] == 0:
+            fingerprints = [image_fingerprint(images[0])] * images.shape[0]
+        else:
+            fingerprints = [image_fingerprint(image) for image in images]
+
+        embeddings = {}
+        missing = {}
+        for i, fingerprint in enumerate(fingerprints):
+            if fingerprint in embeddings or fingerprint in missing:
+                continue
+
+            embedding = self.embedding_cache.get(fingerprint)
+            if embedding is None:
+                missing[fingerprint] = i
+            else:
+                embeddings[fingerprint] = embedding
+
+        if missing:
+            inputs_image_scaled = self.scale_image(images[list(missing.values())])
+
+            encoded = self.call_model(
+                self.image_encoder, self.encoder_function, [inputs_image_scaled]
+            )[0]
+
+            for fingerprint, embedding in zip(missing, encoded):
+                self.embedding_cache.put(fingerprint, embedding)
+                embeddings[fingerprint] = embedding
+
+        return np.stack([embeddings[fingerprint] for fingerprint in fingerprints])
+
+    def split_image_branch(self):
+        """
+        Splits the loaded model into an image encoder, mapping the image input to the \\
+        output of the convolutional image branch, and a head mapping that output and \\
+        the scalar inputs to the model outputs. Layers are shared with the full \\
+        model, so no weights are copied.
+
+        Returns
+        -------
+        tuple
+            Image encoder and head models, or (None, None) if the image branch does \\
+            not feed the rest of the model through a single tensor.
+
+        Note
+        ----
+        Must be called within the model graph.
+        """
+        image_input, scalar_input = self.model.inputs
+
+        def as_list(tensors):
+            return tensors if isinstance(tensors, list) else [tensors]
+
+        # record the layer connectivity before any layer is called on new inputs
+        layers = [
+            (layer, as_list(layer.input), as_list(layer.output))
+            for layer in self.model.layers
+            if not isinstance(layer, keras.layers.InputLayer)
+        ]
+
+        # tensors computed from the image input alone
+        image_tensors = {image_input.name}
+        head_layers = []
+        for layer, inputs, outputs in layers:
+            if all(tensor.name in image_tensors for tensor in inputs):
+                image_tensors.update(tensor.name for tensor in outputs)
+            else:
+                head_layers.append((layer, inputs, outputs))
+
+        boundary = {
+            tensor.name: tensor
+            for layer, inputs, outputs in head_layers
+            for tensor in inputs
+            if tensor.name in image_tensors
+        }
+
+        if len(boundary) != 1 or any(
+            tensor.name in image_tensors for tensor in self.model.outputs
+        ):
+            print("Image branch could not be split, image embeddings are not cached")
+            return None, None
+
+        embedding = list(boundary.values())[0]
+        image_encoder = keras.Model(image_input, embedding)
+
+        # replay the remaining layers on new inputs to build the head
+        embedding_input = keras.Input(shape=keras.backend.int_shape(embedding)[1:])
+        head_scalar_input = keras.Input(shape=keras.backend.int_shape(scalar_input)[1:])
+        tensor_map = {
+            embedding.name: embedding_input,
+            scalar_input.name: head_scalar_input,
+        }
+
+        for layer, inputs, outputs in head_layers:
+            layer_inputs = [tensor_map[tensor.name] for tensor in inputs]
+            if len(layer_inputs) == 1:
+                layer_inputs = layer_inputs[0]
+
+            for tensor, head_tensor in zip(outputs, as_list(layer(layer_inputs))):
+                tensor_map[tensor.name] = head_tensor
+
+        head_model = keras.Model(
+            [embedding_input, head_scalar_input],
+            [tensor_map[tensor.name] for tensor in self.model.outputs],
         )
-        predicted_output["extents"] = predicted_extents
-        predicted_output["image"] = predicted_image_unscaled
 
-        return self.prepare_outputs(predicted_output)
+        return image_encoder, head_model
 
     def evaluate_image(self, settings, position_scale=10e6):
         vec = np.array([[settings[key] for key in self.input_ordering]])
@@ -184,8 +453,7 @@ Example Usage:
         return output, extent
 
     def use_stock_input_image(self):
-        data = np.load(self.stock_image_input)
-        return data
+        return self.stock_image_input
 
     def generate_random_input(self):
         if self.type == "both":
@@ -209,13 +477,13 @@ Example Usage:
     def random_evaluate(self):
         individual = self.generate_random_input()
         if self.type == "scalar":
-            random_eval_output = self.evaluate(individual)
+            random_eval_output = self.evaluate_scalar(individual)
             print("Output Generated")
         elif self.type == "image":
             random_eval_output, extent = self.evaluate_image(individual)
             print("Output Generated")
         else:
-            random_eval_output = self.evaluate(individual)
+            random_eval_output = self.predict(individual)
             print("Output Generated")
         return random_eval_output
 
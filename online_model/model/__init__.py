@@ -1,7 +1,16 @@
 import copy
 import functools
+import time
+import numpy as np
 from p4p.nt.ndarray import ntndarray as NTNDArrayData
-from online_model import REDUNDANT_INPUT_OUTPUT, PROTOCOL, ARRAY_PVS
+from online_model import (
+    REDUNDANT_INPUT_OUTPUT,
+    PROTOCOL,
+    ARRAY_PVS,
+    ARRAY_ENCODINGS,
+    SNAPSHOT_ORDERING,
+)
+from online_model.util import encode_array
 
 # Some input/output variables have the same name and must be unique.
 # Below are utility functions to fix this:
@@ -29,6 +38,71 @@ def apply_temporary_output_patch(output):
     return rebuilt_output
 
 
+def format_output_state(output_state):
+    """
+    Formats arrays appropriately by protocol. Takes a dictionary of process variable \
+    names to values, and formats for assignment. Arrays are encoded with the dtype \
+    configured in ARRAY_ENCODINGS.
+    """
+    rebuilt_output = {}
+    if PROTOCOL == "ca":
+        for pv, value in output_state.items():
+            if pv in ARRAY_PVS:
+                encoded, scale, offset = encode_array(
+                    value, ARRAY_ENCODINGS[pv]["dtype"]
+                )
+                rebuilt_output[f"{pv}:ArrayData_RBV"] = encoded.flatten()
+
+                # [array counter, scale, offset], the counter is set on publication
+                if encoded.dtype.kind == "u":
+                    rebuilt_output[f"{pv}:encoding"] = np.array([0, scale, offset])
+
+            else:
+                rebuilt_output[pv] = value
+
+    elif PROTOCOL == "pva":
+        for pv, value in output_state.items():
+            if pv in ARRAY_PVS:
+                # populate image data
+                encoded, scale, offset = encode_array(
+                    value, ARRAY_ENCODINGS[pv]["dtype"]
+                )
+                array_data = encoded.view(NTNDArrayData)
+
+                # get dw and dh from model output
+                array_data.attrib = {
+                    # "ColorMode": DEFAULT_COLOR_MODE,
+                    "dw": output_state[f"{pv}:dw"],
+                    "dh": output_state[f"{pv}:dh"],
+                }
+
+                if encoded.dtype.kind == "u":
+                    array_data.attrib["scale"] = scale
+                    array_data.attrib["offset"] = offset
+
+                rebuilt_output[pv] = array_data
+
+            # do not build attribute pvs
+            elif not ".dw" in pv and not ".dh" in pv:
+                rebuilt_output[pv] = value
+
+    return rebuilt_output
+
+
+def format_snapshot(sequence, output_state):
+    """
+    Builds the aggregate snapshot value from the input state sequence number and \
+    the scalar outputs of one model evaluation, laid out as [sequence, timestamp, \
+    *outputs in SNAPSHOT_ORDERING].
+    """
+    snapshot = np.empty(len(SNAPSHOT_ORDERING) + 2)
+    snapshot[0] = sequence
+    snapshot[1] = time.time()
+    snapshot[2:] = [output_state[pv] for pv in SNAPSHOT_ORDERING]
+
+    return snapshot
+
+
 def format_outputs_by_protocol(f):
     """
     Wrapper method for formatting arrays appropriately by protocol. \
@@ -38,33 +112,17 @@ def format_outputs_by_protocol(f):
 
     def format_wrapper(*args, **kwargs):
         output_state = f(*args, **kwargs)
-
-        rebuilt_output = {}
-        if PROTOCOL == "ca":
-            for pv, value in output_state.items():
-                if pv in ARRAY_PVS:
-                    rebuilt_output[f"{pv}:ArrayData_RBV"] = value.flatten()
-                else:
-                    rebuilt_output[pv] = value
-
-        elif PROTOCOL == "pva":
-            for pv, value in output_state.items():
-                if pv in ARRAY_PVS:
-                    # populate image data
-                    array_data = value.view(NTNDArrayData)
-
-                    # get dw and dh from model output
-                    array_data.attrib = {
-                        # "ColorMode": DEFAULT_COLOR_MODE,
-                        "dw": output_state[f"{pv}:dw"],
-                        "dh": output_state[f"{pv}:dh"],
-                    }
-                    rebuilt_output[pv] = array_data
-
-                # do not build attribute pvs
-                elif not ".dw" in pv and not ".dh" in pv:
-                    rebuilt_output[pv] = value
-
-        return rebuilt_output
+        return format_output_state(output_state)
 
     return format_wrapper
+
+
+def split_batch_outputs(batch_output):
+    """
+    Splits the columnar output of SurrogateModel.predict_batch into one dictionary \
+    of process variable names to values per evaluated row.
+    """
+    n_rows = len(next(iter(batch_output.values())))
+    return [
+        {pv: values[i] for pv, values in batch_output.items()} for i in range(n_rows)
+    ]
@@ -0,0 +1,238 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Mapping, Union
+
+import numpy as np
+
+
+def image_fingerprint(image: np.ndarray) -> str:
+    """
+    Utility function for fingerprinting image content.
+
+    Parameters
+    ----------
+    image: np.ndarray
+        Image array
+
+    Returns
+    -------
+    str
+        Digest of the image shape, dtype and data.
+
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((image.shape, image.dtype.str)).encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    Thread safe, bounded mapping with least recently used eviction.
+
+    Attributes
+    ----------
+    max_size: int
+        Maximum number of entries held before evicting
+
+    hits: int
+        Number of lookups that found an entry
+
+    misses: int
+        Number of lookups that found no entry
+
+    evictions: int
+        Number of entries evicted to stay within max_size
+
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """
+        Initialize empty cache.
+
+        Parameters
+        ----------
+        max_size: int
+            Maximum number of entries held before evicting
+
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        """
+        Look up an entry and mark it as most recently used.
+
+        Parameters
+        ----------
+        key: hashable
+            Cache key
+
+        Returns
+        -------
+        Cached value or None if the key is not present.
+
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: Hashable, value) -> None:
+        """
+        Store an entry, evicting the least recently used entries if full.
+
+        Parameters
+        ----------
+        key: hashable
+            Cache key
+
+        value
+            Value to store
+
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns hit, miss and eviction counters along with the current size.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class PredictionCache(LRUCache):
+    """
+    LRU cache of model outputs keyed on the quantized input process variable state. \\
+    Output arrays are held as read-only copies, so that consumers of a cached output \\
+    cannot modify the entry served to later lookups.
+
+    Attributes
+    ----------
+    precision: dict
+        Mapping of input process variables to the number of decimals used when \\
+        quantizing values for the cache key
+
+    """
+
+    def __init__(self, max_size: int, precision: Dict[str, int] = None) -> None:
+        """
+        Initialize empty cache.
+
+        Parameters
+        ----------
+        max_size: int
+            Maximum number of model outputs held before evicting
+
+        precision: dict
+            Mapping of input process variables to decimals, e.g. the "prec" entries \\
+            of CMD_PVDB. Variables without a precision are keyed on their full value.
+
+        """
+        super(PredictionCache, self).__init__(max_size)
+        self.precision = precision or {}
+
+    def key(self, pv_state: Mapping[str, Union[float, np.ndarray]]) -> tuple:
+        """
+        Build the cache key for an input process variable state.
+
+        Parameters
+        ----------
+        pv_state: dict
+            State of input process variables, optionally including an "image"
+
+        Returns
+        -------
+        tuple
+            Quantized input values and the image fingerprint.
+
+        """
+        key = []
+        for pv in sorted(pv_state):
+            value = pv_state[pv]
+
+            if pv == "image":
+                key.append((pv, image_fingerprint(value)))
+
+            elif pv in self.precision:
+                key.append((pv, round(float(value), self.precision[pv])))
+
+            else:
+                key.append((pv, float(value)))
+
+        return tuple(key)
+
+    def get(self, key: Hashable) -> Dict[str, Union[float, np.ndarray]]:
+        """
+        Look up the model outputs of an input state and mark them as most recently \\
+        used.
+
+        Parameters
+        ----------
+        key: tuple
+            Cache key built by the key method
+
+        Returns
+        -------
+        dict
+            Mapping of process variables to model output values, with read-only \\
+            arrays, or None if the key is not present.
+
+        """
+        output = super(PredictionCache, self).get(key)
+        if output is None:
+            return None
+
+        return dict(output)
+
+    def put(self, key: Hashable, value: Mapping[str, Union[float, np.ndarray]]) -> None:
+        """
+        Store the model outputs of an input state, copying the output arrays and \\
+        marking the copies read-only.
+
+        Parameters
+        ----------
+        key: tuple
+            Cache key built by the key method
+
+        value: dict
+            Mapping of process variables to model output values
+
+        """
+        output = {}
+        for pv, pv_value in value.items():
+            if isinstance(pv_value, np.ndarray):
+                pv_value = pv_value.copy()
+                pv_value.flags.writeable = False
+
+            output[pv] = pv_value
+
+        super(PredictionCache, self).put(key, output)
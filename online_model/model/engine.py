@@ -0,0 +1,413 @@
+import multiprocessing
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Mapping, Union
+
+import numpy as np
+
+from online_model.model.surrogate_model import SurrogateModel
+from online_model.model import format_output_state, split_batch_outputs
+from online_model import ARRAY_PVS
+
+# default capacity of each shared image buffer, in float64 values
+DEFAULT_BUFFER_SIZE = 2 ** 18
+
+
+def serve_model(model_class, model_kwargs, conn, input_buffer, output_buffer):
+    """
+    Worker process loop. Loads the model, then evaluates batches received over the \\
+    pipe, reading input images from and writing output images to the shared buffers. \\
+    If the model cannot be loaded, the error is sent to the parent and the worker \\
+    exits.
+
+    Parameters
+    ----------
+    model_class
+        Model class to be instantiated
+
+    model_kwargs: dict
+        kwargs for initialization
+
+    conn: multiprocessing.connection.Connection
+        Worker end of the pipe to the parent process
+
+    input_buffer: multiprocessing.sharedctypes.RawArray
+        Shared buffer holding the input images of the current request
+
+    output_buffer: multiprocessing.sharedctypes.RawArray
+        Shared buffer receiving the output images of the current request
+
+    """
+    try:
+        model = model_class(**model_kwargs)
+
+    except Exception as e:
+        conn.send(("error", e))
+        conn.close()
+        return
+
+    conn.send(("ok", (model.input_ordering, model.stock_image_input)))
+
+    input_array = np.frombuffer(input_buffer, dtype=np.float64)
+    output_array = np.frombuffer(output_buffer, dtype=np.float64)
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+
+        vec, image_shape, images = message
+        if image_shape is not None:
+            images = input_array[: int(np.prod(image_shape))].reshape(image_shape)
+
+        try:
+            output = model.predict_batch(vec, images)
+
+        except Exception as e:
+            conn.send(("error", e))
+            continue
+
+        # move image outputs through the shared buffer when they fit
+        array_shapes = {}
+        offset = 0
+        for pv in ARRAY_PVS:
+            if pv in output and offset + output[pv].size <= output_array.size:
+                array = output.pop(pv)
+                output_array[offset : offset + array.size] = array.ravel()
+                array_shapes[pv] = (offset, array.shape)
+                offset += array.size
+
+        conn.send(("ok", (output, array_shapes)))
+
+    conn.close()
+
+
+class ModelProcess:
+    """
+    Handle on a worker process holding a model instance.
+
+    Attributes
+    ----------
+    process: multiprocessing.Process
+        Worker process
+
+    conn: multiprocessing.connection.Connection
+        Parent end of the pipe to the worker
+
+    input_array: np.ndarray
+        View of the shared input image buffer
+
+    output_array: np.ndarray
+        View of the shared output image buffer
+
+    """
+
+    def __init__(self, context, model_class, model_kwargs: dict, buffer_size: int):
+        """
+        Allocate the shared buffers and start the worker process.
+
+        Parameters
+        ----------
+        context: multiprocessing.context.BaseContext
+            Multiprocessing context used to create the process and buffers
+
+        model_class
+            Model class to be instantiated in the worker
+
+        model_kwargs: dict
+            kwargs for initialization
+
+        buffer_size: int
+            Capacity of each shared image buffer in float64 values
+
+        """
+        self.conn, worker_conn = context.Pipe()
+        input_buffer = context.RawArray("d", buffer_size)
+        output_buffer = context.RawArray("d", buffer_size)
+
+        self.input_array = np.frombuffer(input_buffer, dtype=np.float64)
+        self.output_array = np.frombuffer(output_buffer, dtype=np.float64)
+
+        self.process = context.Process(
+            target=serve_model,
+            args=(model_class, model_kwargs, worker_conn, input_buffer, output_buffer),
+            daemon=True,
+        )
+        self.process.start()
+
+        # only the worker holds its end, so the pipe reports EOF if the worker exits
+        worker_conn.close()
+
+    def wait_loaded(self, poll_interval: float = 0.5) -> tuple:
+        """
+        Block until the worker has loaded its model.
+
+        Parameters
+        ----------
+        poll_interval: float
+            Time in seconds between checks that the worker is still alive
+
+        Returns
+        -------
+        tuple
+            Input ordering and stock image input of the worker model.
+
+        Raises
+        ------
+        Exception
+            Error raised by the worker while loading the model, or RuntimeError if \\
+            the worker exited before loading it.
+
+        """
+        while not self.conn.poll(poll_interval):
+            if not self.process.is_alive():
+                break
+
+        try:
+            status, result = self.conn.recv()
+
+        except EOFError:
+            self.process.join()
+            raise RuntimeError(
+                f"Model worker exited with code {self.process.exitcode} before "
+                "loading the model"
+            )
+
+        if status == "error":
+            raise result
+
+        return result
+
+    def predict_batch(self, vec: np.ndarray, images: np.ndarray) -> dict:
+        """
+        Evaluate a batch in the worker process.
+
+        Parameters
+        ----------
+        vec: np.ndarray
+            Scalar inputs of shape (N, len(input_ordering))
+
+        images: np.ndarray
+            Single input image or stack of N images
+
+        Returns
+        -------
+        dict
+            Columnar outputs as returned by the model predict_batch method.
+
+        """
+        if images.size <= self.input_array.size:
+            self.input_array[: images.size] = images.ravel()
+            self.conn.send((vec, images.shape, None))
+
+        else:
+            self.conn.send((vec, None, np.ascontiguousarray(images)))
+
+        status, result = self.conn.recv()
+        if status == "error":
+            raise result
+
+        output, array_shapes = result
+        for pv, (offset, shape) in array_shapes.items():
+            array = self.output_array[offset : offset + int(np.prod(shape))]
+            output[pv] = array.reshape(shape).copy()
+
+        return output
+
+    def close(self) -> None:
+        """
+        Stop the worker process.
+        """
+        self.conn.send(None)
+        self.process.join()
+
+    def terminate(self) -> None:
+        """
+        Stop the worker process without waiting for the current request.
+        """
+        self.process.terminate()
+        self.process.join()
+
+
+class ProcessPoolSurrogateModel(SurrogateModel):
+    """
+    Surrogate model that evaluates requests on a pool of worker processes, each \\
+    holding its own instance of the model class. Requests are sharded across idle \\
+    workers and images are transported through shared memory buffers rather than \\
+    being pickled.
+
+    Attributes
+    ----------
+    input_ordering: list
+        Input variable ordering of the worker models
+
+    stock_image_input: np.ndarray
+        Default input image of the worker models
+
+    shard_min_rows: int
+        Batches of at least this many rows are split across all workers
+
+    """
+
+    shard_min_rows = 64
+
+    def __init__(
+        self,
+        model_class,
+        model_kwargs: dict,
+        num_processes: int,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> None:
+        """
+        Start the worker processes and wait for their models to load. If a worker \\
+        fails to load its model, all workers are stopped and its error is raised.
+
+        Parameters
+        ----------
+        model_class
+            Model class to be instantiated in each worker
+
+        model_kwargs: dict
+            kwargs for initialization
+
+        num_processes: int
+            Number of worker processes
+
+        buffer_size: int
+            Capacity of each shared image buffer in float64 values. Images that do \\
+            not fit are sent through the pipe instead.
+
+        """
+        if num_processes < 1:
+            raise ValueError("num_processes must be at least 1.")
+
+        # tensorflow is not fork safe
+        context = multiprocessing.get_context("spawn")
+
+        self.workers = [
+            ModelProcess(context, model_class, model_kwargs, buffer_size)
+            for i in range(num_processes)
+        ]
+
+        self._idle = queue.Queue()
+        try:
+            for worker in self.workers:
+                self.input_ordering, self.stock_image_input = worker.wait_loaded()
+                self._idle.put(worker)
+
+        except Exception:
+            for worker in self.workers:
+                worker.terminate()
+            raise
+
+        self._executor = ThreadPoolExecutor(max_workers=num_processes)
+
+    def predict(
+        self, settings: Dict[str, float]
+    ) -> Mapping[str, Union[float, np.ndarray]]:
+        """
+        Evaluate a single input state on an idle worker.
+
+        Parameters
+        ----------
+        settings: dict
+            State of input variables, optionally including an "image"
+
+        Returns
+        -------
+        dict
+            Mapping of process variables to model output values, formatted by \\
+            protocol.
+
+        """
+        output = split_batch_outputs(self.predict_batch([settings]))[0]
+        return format_output_state(output)
+
+    def predict_batch(self, inputs, images=None) -> dict:
+        """
+        Evaluate N input states on the worker processes. Large batches are split \\
+        evenly across all workers.
+
+        Parameters
+        ----------
+        inputs: np.ndarray or list
+            2-D array of input rows or list of settings dictionaries
+
+        images: np.ndarray, optional
+            Single image or stack of N images
+
+        Returns
+        -------
+        dict
+            Columnar outputs mapping each output to an array with N rows.
+
+        """
+        vec, images = self.stack_inputs(inputs, images)
+
+        if len(vec) < self.shard_min_rows or len(self.workers) == 1:
+            return self._run_on_idle_worker(vec, images)
+
+        shards = np.array_split(np.arange(len(vec)), len(self.workers))
+        futures = [
+            self._executor.submit(
+                self._run_on_idle_worker, vec[rows], images[rows[0] : rows[-1] + 1]
+            )
+            for rows in shards
+        ]
+        outputs = [future.result() for future in futures]
+
+        return {
+            pv: np.concatenate([output[pv] for output in outputs]) for pv in outputs[0]
+        }
+
+    def _run_on_idle_worker(self, vec: np.ndarray, images: np.ndarray) -> dict:
+        """
+        Wait for an idle worker and evaluate the batch on it.
+        """
+        # a broadcast stack repeats one image, so only transport it once
+        if images.shape[0] > 1 and images.strides[0] == 0:
+            images = images[0]
+
+        worker = self._idle.get()
+        try:
+            return worker.predict_batch(vec, images)
+
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        """
+        Stop all worker processes.
+        """
+        self._executor.shutdown()
+        for worker in self.workers:
+            worker.close()
+
+
+def build_surrogate_model(
+    model_class, model_kwargs: dict, num_processes: int = 0
+) -> SurrogateModel:
+    """
+    Utility function for building the surrogate model used by the servers.
+
+    Parameters
+    ----------
+    model_class
+        Model class to be instantiated
+
+    model_kwargs: dict
+        kwargs for initialization
+
+    num_processes: int
+        Number of worker processes. If 0, the model is loaded in this process.
+
+    Returns
+    -------
+    SurrogateModel
+        Model instance, or a ProcessPoolSurrogateModel over num_processes workers.
+
+    """
+    if num_processes:
+        return ProcessPoolSurrogateModel(model_class, model_kwargs, num_processes)
+
+    return model_class(**model_kwargs)
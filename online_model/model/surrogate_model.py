@@ -1,11 +1,14 @@
 import numpy as np
 import time
-from typing import Dict, Tuple, Mapping, Union
+from typing import Dict, List, Tuple, Mapping, Union
 from abc import ABC, abstractmethod
 
 import tensorflow as tf
 import h5py
 
+from online_model.model import format_output_state, split_batch_outputs
+from online_model.model.cache import PredictionCache
+
 
 # TODO: What are bins? What is ext?
 
@@ -28,6 +31,61 @@ class SurrogateModel(ABC):
         """
         pass
 
+    def predict_batch(self, inputs, images=None):
+        """
+        Batched prediction method. Inheriting classes may overwrite this to evaluate \\
+        many input settings in a single model call.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support batched prediction."
+        )
+
+    def stack_inputs(self, inputs, images=None):
+        """
+        Assembles batch inputs into a 2-D scalar array and an image stack, using the \\
+        input_ordering and stock_image_input attributes of the model.
+
+        Parameters
+        ----------
+        inputs: np.ndarray or list
+            2-D array of input rows or list of settings dictionaries
+
+        images: np.ndarray, optional
+            Single image or stack of images
+
+        Returns
+        -------
+        tuple
+            Scalar inputs of shape (N, len(input_ordering)) and images stacked along \\
+            a leading axis of length N.
+        """
+        if len(inputs) and isinstance(inputs[0], dict):
+            vec = np.array(
+                [[settings[key] for key in self.input_ordering] for settings in inputs],
+                dtype=float,
+            )
+            if images is None and any("image" in settings for settings in inputs):
+                images = np.array(
+                    [
+                        settings.get("image", self.stock_image_input)
+                        for settings in inputs
+                    ]
+                )
+
+        else:
+            vec = np.atleast_2d(np.asarray(inputs, dtype=float))
+
+        if images is None:
+            images = self.stock_image_input
+
+        images = np.asarray(images)
+
+        # broadcast a single image across all rows
+        if images.ndim == np.ndim(self.stock_image_input):
+            images = np.broadcast_to(images, (vec.shape[0],) + images.shape)
+
+        return vec, images
+
 
 def load_model_info(model_file: str) -> ModelInfo:
     """
@@ -69,7 +127,7 @@ class OnlineSurrogateModel:
     Understand the preprocessing here
     """
 
-    def __init__(self, models) -> None:
+    def __init__(self, models, cache: PredictionCache = None) -> None:
         """
         Initialize OnlineSurrogateModel instance using given scalar and image model \\
         files.
@@ -79,8 +137,12 @@ class OnlineSurrogateModel:
         models: list
             list of model objects
 
+        cache: online_model.model.cache.PredictionCache, optional
+            Cache of previously computed outputs. May be shared between instances.
+
         """
         self.models = models
+        self.cache = cache
 
     def run(self, pv_state: Dict[str, float]) -> Mapping[str, Union[float, np.ndarray]]:
         """
@@ -99,14 +161,112 @@ class OnlineSurrogateModel:
         """
         t1 = time.time()
 
+        # key on the state before the models fill in defaults
+        if self.cache is not None:
+            key = self.cache.key(pv_state)
+            cached_output = self.cache.get(key)
+
+            if cached_output is not None:
+                print("Using cached output... " + str(self.cache.stats()))
+                return cached_output
+
         output = {}
 
         for model in self.models:
             predicted_output = model.predict(pv_state)
             output.update(predicted_output)
 
+        if self.cache is not None:
+            self.cache.put(key, output)
+
         t2 = time.time()
         print("Running model...", end="")
         print("Ellapsed time: " + str(t2 - t1))
 
         return output
+
+    def run_columns(
+        self, inputs: np.ndarray, images: np.ndarray = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Executes the models for a 2-D array of input rows using one batched model \\
+        call per model. Outputs are returned unformatted and are not cached.
+
+        Parameters
+        ----------
+        inputs: np.ndarray
+            Input rows of shape (N, len(input_ordering)), columns in model \\
+            input_ordering order
+
+        images: np.ndarray, optional
+            Single image or stack of N images. Defaults to the stock image input.
+
+        Returns
+        -------
+        dict
+            Columnar outputs mapping each output to an array with N rows.
+
+        """
+        t1 = time.time()
+
+        output = {}
+        for model in self.models:
+            output.update(model.predict_batch(inputs, images))
+
+        t2 = time.time()
+        print(f"Running model on {len(inputs)} rows...", end="")
+        print("Ellapsed time: " + str(t2 - t1))
+
+        return output
+
+    def run_batch(
+        self, pv_states: List[Dict[str, float]]
+    ) -> List[Mapping[str, Union[float, np.ndarray]]]:
+        """
+        Executes the models for many process variable states using one batched model \\
+        call per model. States found in the cache are not re-evaluated.
+
+        Parameters
+        ----------
+        pv_states: list
+            States of input process variables.
+
+        Returns
+        -------
+        list
+            Mapping of process variables to model output values for each state.
+
+        """
+        t1 = time.time()
+
+        outputs = [None] * len(pv_states)
+        keys = [None] * len(pv_states)
+
+        if self.cache is not None:
+            for i, pv_state in enumerate(pv_states):
+                keys[i] = self.cache.key(pv_state)
+                cached_output = self.cache.get(keys[i])
+                if cached_output is not None:
+                    outputs[i] = cached_output
+
+        pending = [i for i, output in enumerate(outputs) if output is None]
+
+        if pending:
+            for i in pending:
+                outputs[i] = {}
+
+            for model in self.models:
+                batch_output = model.predict_batch([pv_states[i] for i in pending])
+                rows = split_batch_outputs(batch_output)
+                for i, row in zip(pending, rows):
+                    outputs[i].update(format_output_state(row))
+
+            if self.cache is not None:
+                for i in pending:
+                    self.cache.put(keys[i], outputs[i])
+
+        t2 = time.time()
+        print(f"Running model on batch of {len(pending)}...", end="")
+        print("Ellapsed time: " + str(t2 - t1))
+
+        return outputs
@@ -1,13 +1,29 @@
-import copy
 import numpy as np
+import queue
 import random
+import threading
 from typing import Dict, Mapping, Union
 
 from epics import caget
 from pcaspy import Driver, SimpleServer
 
 from online_model.model.surrogate_model import OnlineSurrogateModel
-from online_model import ARRAY_PVS, DEFAULT_PRECISION, DEFAULT_COLOR_MODE
+from online_model.model.cache import PredictionCache
+from online_model.model.engine import build_surrogate_model
+from online_model.server.changes import OutputChangeFilter
+from online_model.server.state import StateStore
+from online_model.model import format_snapshot
+from online_model import (
+    ARRAY_PVS,
+    DEFAULT_PRECISION,
+    DEFAULT_COLOR_MODE,
+    STATS_PVDB,
+    INPUT_ARRAY_PV,
+    INPUT_ARRAY_PVDB,
+    INPUT_ORDERING,
+    SNAPSHOT_PV,
+    SNAPSHOT_PVDB,
+)
 
 from online_model.util import build_image_pvs
 
@@ -19,12 +35,19 @@ class SimDriver(Driver):
     Attributes
     ----------
     input_pv_state: dict
-        Dictionary mapping initial input process variables to values.
+        Dictionary mapping input process variables to their initial values. The \\
+        current values are held by state.
 
     output_pv_state: dict
         Dictionary mapping initial output process variables to values (np.ndarray in \\
         the case of image x:y)
 
+    state: online_model.server.state.StateStore
+        Versioned input process variable state
+
+    input_changed: threading.Event
+        Event set on every write to an input process variable
+
     """
 
     def __init__(
@@ -51,6 +74,10 @@ class SimDriver(Driver):
         self.input_pv_state = input_pv_state
         self.output_pv_state = output_pv_state
 
+        # version input changes and signal them to the inference worker
+        self.state = StateStore(input_pv_state)
+        self.input_changed = threading.Event()
+
     def read(self, pv: str) -> Union[float, np.ndarray]:
         """
         Method used by server when clients read a process variable.
@@ -79,8 +106,9 @@ class SimDriver(Driver):
 
     def write(self, pv: str, value: Union[float, np.ndarray]) -> bool:
         """
-        Method used by server when clients write a process variable.
-
+        Method used by server when clients write a process variable. A write to the \
+        aggregate input process variable sets every input at once and triggers a \
+        single evaluation.
 
         Parameters
         ----------
@@ -104,12 +132,33 @@ class SimDriver(Driver):
             print(pv + " is a read-only pv")
             return False
 
+        elif pv == INPUT_ARRAY_PV:
+            if len(value) != len(INPUT_ORDERING):
+                print(f"{pv} requires {len(INPUT_ORDERING)} values")
+                return False
+
+            self.state.update(dict(zip(INPUT_ORDERING, value)))
+            for input_pv, input_value in zip(INPUT_ORDERING, value):
+                self.setParam(input_pv, input_value)
+
+            self.setParam(pv, value)
+            self.updatePVs()
+            self.input_changed.set()
+
+            return True
+
         else:
 
+            self.setParam(pv, value)
+
             if pv in self.input_pv_state:
-                self.input_pv_state[pv] = value
+                _, pv_state = self.state.update({pv: value})
+
+                # keep the aggregate input process variable in sync
+                self.setParam(INPUT_ARRAY_PV, [pv_state[key] for key in INPUT_ORDERING])
+
+                self.input_changed.set()
 
-            self.setParam(pv, value)
             self.updatePVs()
 
             return True
@@ -138,8 +187,9 @@ class SimDriver(Driver):
 
 class CAServer:
     """
-    Server object for channel access process variables that updates and reads process \\
-    values in a single thread.
+    Server object for channel access process variables. Channel access transactions \\
+    and output publication run on the server thread, while the model is evaluated on \\
+    a separate inference worker thread.
 
     Attributes
     ----------
@@ -151,7 +201,8 @@ class CAServer:
         (precision), value (float), units (str), range (List[float])
 
     input_pv_state: dict
-        Dictionary that maps the input process variables to their current values
+        Dictionary that maps the input process variables to their initial values. \\
+        The current values are held by the versioned state of the driver.
 
     output_pv_state:
         Dictionary that maps the output process variables to their current values
@@ -163,8 +214,28 @@ class CAServer:
     driver: online_model.server.ca.SimDriver
         Class that reacts to process variable read/write requests
 
+    process_timeout: float
+        Time in seconds the server thread waits for channel access activity while \\
+        no model outputs are awaited
+
+    busy_process_timeout: float
+        Time in seconds the server thread waits for channel access activity before \\
+        checking for new model outputs, while an input change is being evaluated
+
+    evaluating: bool
+        Whether the inference worker is evaluating an input state
+
+    stale_drops: int
+        Number of input states superseded by a newer write before being evaluated
+
+    output_filter: online_model.server.changes.OutputChangeFilter
+        Filter limiting output publication to changed values
+
     """
 
+    process_timeout = 0.1
+    busy_process_timeout = 0.01
+
     def __init__(
         self,
         model_class,
@@ -172,6 +243,8 @@ class CAServer:
         input_pvdb: Dict[str, dict],
         output_pvdb: Dict[str, dict],
         prefix: str,
+        cache_size: int = 0,
+        num_processes: int = 0,
     ) -> None:
         """
         Create OnlineSurrogateModel instance and initialize output variables by running \\
@@ -195,21 +268,48 @@ class CAServer:
             Dictionary that maps the output process variable string to type (str), prec \\
             (precision), value (float), units (str), range (List[float])
 
+        prefix: str
+            Prefix to use when serving
+
+        cache_size: int
+            Number of model outputs to cache, keyed on the input state quantized to \\
+            the input process variable precision. Caching is disabled if 0.
+
+        num_processes: int
+            Number of worker processes evaluating the model. If 0, the model is \\
+            loaded in the server process.
+
         """
-        surrogate_model = model_class(**model_kwargs)
-        self.model = OnlineSurrogateModel([surrogate_model])
+        cache = None
+        if cache_size:
+            cache = PredictionCache(
+                cache_size, {pv: input_pvdb[pv]["prec"] for pv in input_pvdb}
+            )
+
+        surrogate_model = build_surrogate_model(
+            model_class, model_kwargs, num_processes
+        )
+        self.model = OnlineSurrogateModel([surrogate_model], cache=cache)
 
         # set up db for initializing process variables
         self.pvdb = {}
 
         # set up input process variables
         self.pvdb.update(input_pvdb)
+        self.pvdb.update(INPUT_ARRAY_PVDB)
         self.input_pv_state = {pv: input_pvdb[pv]["value"] for pv in input_pvdb}
 
         # get starting output from the model and set up output process variables
-        self.output_pv_state = self.model.run(self.input_pv_state)
+        self.output_pv_state = self.model.run(dict(self.input_pv_state))
         self.pvdb.update(output_pvdb)
 
+        # serve statistics and the aggregate snapshot as read-only outputs
+        self.stale_drops = 0
+        self.pvdb.update(STATS_PVDB)
+        self.output_pv_state.update({pv: STATS_PVDB[pv]["value"] for pv in STATS_PVDB})
+        self.pvdb.update(SNAPSHOT_PVDB)
+        self.output_pv_state[SNAPSHOT_PV] = format_snapshot(0, self.output_pv_state)
+
         # initialize channel access server
         self.server = SimpleServer()
 
@@ -220,29 +320,121 @@ class CAServer:
         # set up driver for handing read and write requests to process variables
         self.driver = SimDriver(self.input_pv_state, self.output_pv_state)
 
+        # model outputs waiting to be published from the server thread
+        self.output_queue = queue.Queue()
+        self.evaluating = False
+
+        # only publish outputs that changed by more than their deadband
+        self.output_filter = OutputChangeFilter(self.pvdb)
+
     def start_server(self) -> None:
         """
-        Start the channel access server and continually update.
+        Start the inference worker and the channel access server, and publish model \\
+        outputs as they become available.
         """
-        sim_pv_state = copy.deepcopy(self.input_pv_state)
-
         # Initialize output variables
         print("Initializing sim...")
-        output_pv_state = self.model.run(self.input_pv_state)
-        self.driver.set_output_pvs(output_pv_state)
+        sequence, pv_state = self.driver.state.snapshot()
+        output_pv_state = self.model.run(pv_state)
+        output_pv_state[SNAPSHOT_PV] = format_snapshot(sequence, output_pv_state)
+        self.output_queue.put((sequence, output_pv_state))
+        self.publish_outputs()
         print("...finished initializing.")
 
+        inference_worker = threading.Thread(target=self.run_inference, daemon=True)
+        inference_worker.start()
+
         while True:
-            # process channel access transactions
-            self.server.process(0.1)
-
-            # check if the input process variable state has been updated as
-            # an indicator of new input values
-            while not all(
-                np.array_equal(sim_pv_state[key], self.input_pv_state[key])
-                for key in self.input_pv_state
-            ):
-
-                sim_pv_state = copy.deepcopy(self.input_pv_state)
-                model_output = self.model.run(self.input_pv_state)
-                self.driver.set_output_pvs(model_output)
+            # process channel access transactions, only polling for model outputs
+            # at the higher rate while they are awaited
+            if self.awaiting_outputs():
+                self.server.process(self.busy_process_timeout)
+
+            else:
+                self.server.process(self.process_timeout)
+
+            self.publish_outputs()
+
+    def awaiting_outputs(self) -> bool:
+        """
+        Whether an input change is waiting for or under evaluation, or its outputs \\
+        are waiting to be published.
+        """
+        return (
+            self.driver.input_changed.is_set()
+            or self.evaluating
+            or not self.output_queue.empty()
+        )
+
+    def run_inference(self) -> None:
+        """
+        Inference worker loop. Waits for the driver to signal an input change, then \\
+        evaluates the model on a snapshot of the input process variable state. \\
+        Writes arriving during an evaluation are coalesced, so only the latest input \\
+        state is evaluated next.
+        """
+        evaluated_version = self.driver.state.sequence
+
+        while True:
+            self.driver.input_changed.wait()
+
+            # mark the evaluation before clearing, so the server thread keeps polling
+            self.evaluating = True
+            self.driver.input_changed.clear()
+
+            # writes arriving after the clear set the event again
+            input_version, pv_state = self.driver.state.snapshot()
+
+            # every write between two evaluations except the latest is dropped
+            if input_version > evaluated_version + 1:
+                self.stale_drops += input_version - evaluated_version - 1
+            evaluated_version = input_version
+
+            try:
+                model_output = self.model.run(pv_state)
+
+            except Exception as e:
+                print(f"Model evaluation failed for input version {input_version}: {e}")
+
+            else:
+                model_output["stale_drops"] = self.stale_drops
+                model_output[SNAPSHOT_PV] = format_snapshot(input_version, model_output)
+                self.output_queue.put((input_version, model_output))
+
+            self.evaluating = False
+
+    def publish_outputs(self) -> None:
+        """
+        Publish the changed values of the most recent model output from the server \\
+        thread, unless outputs of a newer input state have already been published.
+        """
+        latest = None
+        while True:
+            try:
+                latest = self.output_queue.get_nowait()
+
+            except queue.Empty:
+                break
+
+        if latest is None:
+            return
+
+        sequence, model_output = latest
+        with self.driver.state.publishing(sequence) as current:
+            changed = self.output_filter.changed(model_output) if current else {}
+            changed["stale_results"] = self.driver.state.stale_results
+
+            # count new frames with the input sequence they were evaluated from, and
+            # publish the frame data and encoding together, tagged with the counter
+            for pv in ARRAY_PVS:
+                data, encoding = f"{pv}:ArrayData_RBV", f"{pv}:encoding"
+
+                if data in changed or encoding in changed:
+                    changed[data] = model_output[data]
+                    changed[f"{pv}:ArrayCounter_RBV"] = sequence
+
+                    if encoding in model_output:
+                        changed[encoding] = [sequence, *model_output[encoding][1:]]
+
+            self.driver.set_output_pvs(changed)
+            self.driver.updatePVs()
@@ -0,0 +1,79 @@
+import threading
+from typing import Dict, Mapping, Union
+
+import numpy as np
+
+from online_model.model.cache import image_fingerprint
+
+
+class OutputChangeFilter:
+    """
+    Tracks the last published value of each output process variable and filters \\
+    model outputs down to the values that have changed.
+
+    Scalars are compared against a per process variable deadband taken from the \\
+    "mdel" entry of the process variable database, publishing only changes larger \\
+    than the deadband (any change if no "mdel" is given). Arrays are compared by \\
+    content hash.
+
+    Attributes
+    ----------
+    deadbands: dict
+        Mapping of process variables to their deadband
+
+    """
+
+    def __init__(self, pvdb: Dict[str, dict]) -> None:
+        """
+        Read the deadbands from the process variable database.
+
+        Parameters
+        ----------
+        pvdb: dict
+            Dictionary that maps the output process variables to type (str), prec \\
+            (precision), units (str) and optionally mdel (float)
+
+        """
+        self.deadbands = {pv: pvdb[pv]["mdel"] for pv in pvdb if "mdel" in pvdb[pv]}
+        self._published = {}
+        self._lock = threading.Lock()
+
+    def changed(
+        self, output_pv_state: Mapping[str, Union[float, np.ndarray]]
+    ) -> Dict[str, Union[float, np.ndarray]]:
+        """
+        Returns the outputs that differ from the last published values and records \\
+        them as published.
+
+        Parameters
+        ----------
+        output_pv_state: dict
+            Mapping of output process variables to model output values
+
+        Returns
+        -------
+        dict
+            Mapping of the changed output process variables to their values
+
+        """
+        changed = {}
+
+        with self._lock:
+            for pv, value in output_pv_state.items():
+                if isinstance(value, np.ndarray):
+                    # array attributes such as the pva image extents count as content
+                    signature = (
+                        image_fingerprint(value),
+                        repr(sorted(getattr(value, "attrib", {}).items())),
+                    )
+                    if self._published.get(pv) != signature:
+                        self._published[pv] = signature
+                        changed[pv] = value
+
+                elif pv not in self._published or abs(
+                    value - self._published[pv]
+                ) > self.deadbands.get(pv, 0):
+                    self._published[pv] = value
+                    changed[pv] = value
+
+        return changed
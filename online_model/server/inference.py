@@ -0,0 +1,301 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Mapping, Union
+
+import numpy as np
+
+
+class BatchRequest:
+    """
+    Pending model run request submitted to a MicroBatcher.
+
+    Attributes
+    ----------
+    pv_state: dict
+        Snapshot of the input process variable state to evaluate
+
+    sequence: int
+        Sequence number of the input state, if versioned
+
+    result: dict
+        Mapping of process variables to model output values, populated once the \\
+        batch containing the request has been evaluated
+
+    superseded: bool
+        Whether the request was skipped without evaluation, as a newer input state \\
+        had been submitted
+
+    error: Exception
+        Exception raised while evaluating the batch, if any
+
+    """
+
+    def __init__(self, pv_state: Dict[str, float], sequence: int = None) -> None:
+        """
+        Store the input state and set up the completion event.
+
+        Parameters
+        ----------
+        pv_state: dict
+            Snapshot of the input process variable state to evaluate
+
+        sequence: int, optional
+            Sequence number of the input state
+
+        """
+        self.pv_state = pv_state
+        self.sequence = sequence
+        self.result = None
+        self.superseded = False
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def set_result(self, result: Mapping[str, Union[float, np.ndarray]]) -> None:
+        """
+        Store the model output and wake the waiting caller.
+        """
+        self.result = result
+        self._finish()
+
+    def set_superseded(self) -> None:
+        """
+        Mark the request as skipped and wake the waiting caller.
+        """
+        self.superseded = True
+        self._finish()
+
+    def set_error(self, error: Exception) -> None:
+        """
+        Store the evaluation error and wake the waiting caller.
+        """
+        self.error = error
+        self._finish()
+
+    def add_done_callback(self, callback: Callable[["BatchRequest"], None]) -> None:
+        """
+        Register a function called with the request once it has been evaluated, \\
+        from the batcher worker thread, or at once if already evaluated.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def _finish(self) -> None:
+        """
+        Wake the waiting caller and run the done callbacks.
+        """
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback(self)
+
+            except Exception as e:
+                print("Batch request callback failed")
+                print(e)
+
+    def wait(self) -> Mapping[str, Union[float, np.ndarray]]:
+        """
+        Block until the request has been evaluated.
+
+        Returns
+        -------
+        dict
+            Mapping of process variables to model output values, or None if the \\
+            request was superseded.
+
+        """
+        self._done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+class MicroBatcher:
+    """
+    Gathers model run requests submitted from many threads and evaluates them as one \\
+    batched inference on a fixed pool of worker threads.
+
+    Attributes
+    ----------
+    run_batch: callable
+        Function mapping a list of input process variable states to a list of model \\
+        outputs, e.g. OnlineSurrogateModel.run_batch
+
+    max_batch_size: int
+        Maximum number of requests evaluated in one batch
+
+    max_wait: float
+        Maximum time in seconds to wait for additional requests once the first \\
+        request of a batch has arrived
+
+    num_workers: int
+        Number of worker threads collecting and evaluating batches
+
+    is_superseded: callable
+        Function telling from the sequence number of an input state whether a \\
+        newer state exists, e.g. StateStore.is_superseded. Superseded requests are \\
+        skipped without being evaluated.
+
+    Note
+    ----
+    run_batch is called concurrently from all workers and must be thread safe.
+
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Dict[str, float]]], List[dict]],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        num_workers: int = 1,
+        is_superseded: Callable[[int], bool] = None,
+    ) -> None:
+        """
+        Store batching configuration and start the worker threads.
+
+        Parameters
+        ----------
+        run_batch: callable
+            Function mapping a list of input process variable states to a list of \\
+            model outputs
+
+        max_batch_size: int
+            Maximum number of requests evaluated in one batch
+
+        max_wait: float
+            Maximum time in seconds to wait for additional requests
+
+        num_workers: int
+            Number of worker threads collecting and evaluating batches
+
+        is_superseded: callable, optional
+            Function telling whether the input state of a sequence number has been \\
+            superseded. Requests without a sequence number are always evaluated.
+
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1.")
+
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_workers = num_workers
+        self.is_superseded = is_superseded
+
+        self._queue = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._process, daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, pv_state: Dict[str, float], sequence: int = None) -> BatchRequest:
+        """
+        Queue an input state for evaluation.
+
+        Parameters
+        ----------
+        pv_state: dict
+            Snapshot of the input process variable state
+
+        sequence: int, optional
+            Sequence number of the input state
+
+        Returns
+        -------
+        BatchRequest
+            Request whose wait method returns the model output.
+
+        """
+        request = BatchRequest(pv_state, sequence)
+        self._queue.put(request)
+        return request
+
+    def run(
+        self, pv_state: Dict[str, float], sequence: int = None
+    ) -> Mapping[str, Union[float, np.ndarray]]:
+        """
+        Queue an input state and block until its output is available.
+
+        Parameters
+        ----------
+        pv_state: dict
+            Snapshot of the input process variable state
+
+        sequence: int, optional
+            Sequence number of the input state
+
+        Returns
+        -------
+        dict
+            Mapping of process variables to model output values, or None if the \\
+            input state was superseded before being evaluated.
+
+        """
+        return self.submit(pv_state, sequence).wait()
+
+    def _collect(self) -> List[BatchRequest]:
+        """
+        Block for the first request, then gather further requests until the batch is \\
+        full or max_wait has elapsed.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _process(self) -> None:
+        """
+        Worker loop: evaluate each collected batch and hand results to the callers.
+        """
+        while True:
+            batch = self._collect()
+
+            # do not spend the model on input states that can only produce stale outputs
+            if self.is_superseded is not None:
+                for request in batch:
+                    if request.sequence is not None:
+                        if self.is_superseded(request.sequence):
+                            request.set_superseded()
+
+                batch = [request for request in batch if not request.superseded]
+
+                if not batch:
+                    continue
+
+            try:
+                results = self.run_batch([request.pv_state for request in batch])
+
+            except Exception as e:
+                for request in batch:
+                    request.set_error(e)
+
+            else:
+                for request, result in zip(batch, results):
+                    request.set_result(result)
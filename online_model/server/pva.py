@@ -1,46 +1,145 @@
-import threading
 import numpy as np
-from typing import Dict
+import threading
+from typing import Dict, Mapping, Union
 
-from p4p.nt import NTScalar, NTNDArray
+from p4p import Value
+from p4p.nt import NTScalar, NTNDArray, NTTable
+from p4p.nt.ndarray import ntndarray as NTNDArrayData
 from p4p.server.thread import SharedPV
 from p4p.server import Server
 
 from online_model.model.surrogate_model import OnlineSurrogateModel
-from online_model import ARRAY_PVS, DEFAULT_COLOR_MODE
+from online_model.model.cache import PredictionCache
+from online_model.model.engine import build_surrogate_model
+from online_model.server.inference import MicroBatcher, BatchRequest
+from online_model.server.changes import OutputChangeFilter
+from online_model.server.state import StateStore
+from online_model.model import format_snapshot
+from online_model import (
+    ARRAY_PVS,
+    ARRAY_ENCODINGS,
+    DEFAULT_COLOR_MODE,
+    STATS_PVDB,
+    INPUT_ARRAY_PV,
+    INPUT_ORDERING,
+    BATCH_PV,
+    BATCH_IMAGE_PV,
+    BATCH_INPUT_COLUMNS,
+    SNAPSHOT_PV,
+)
+from online_model.util import compress_bytes, pva_field_name, ND_DATA_TYPES
+
+
+class SequencedNTNDArray(NTNDArray):
+    """
+    NTNDArray type setting the uniqueId field on wrap, so that clients can detect \\
+    new frames without comparing the array data.
+    """
+
+    def wrap(self, value, unique_id: int = 0, **kws) -> Value:
+        """
+        Wrap numpy.ndarray as NTNDArray Value with the given uniqueId.
+        """
+        if isinstance(value, Value):
+            return value
+
+        wrapped = super(SequencedNTNDArray, self).wrap(value, **kws)
+        wrapped["uniqueId"] = unique_id
+
+        return wrapped
 
 
-class ModelLoader(threading.local):
+class CompressedNTNDArray(SequencedNTNDArray):
     """
-    Subclass of threading.local that will initialize the OnlineSurrogateModel in each \\
-    thread.
+    NTNDArray type that compresses the array data on wrap, following the \\
+    areaDetector convention: the value holds the compressed bytes, codec.name the \\
+    codec and codec.parameters the NDArray data type code of the original array.
 
     Attributes
     ----------
-    model: online_model.model.surrogate_model.OnlineSurrogateModel
-        OnlineSurrogateModel instance used for getting predictions
+    codec: str
+        Compression codec ("zlib", "lz4" or "blosc")
 
-    Note
-    ----
-    Keras models are not thread safe so the model must be loaded in each thread and \\
-    referenced locally.
     """
 
-    def __init__(self, model_class, model_kwargs: dict) -> None:
+    def __init__(self, codec: str, **kws) -> None:
+        super(CompressedNTNDArray, self).__init__(**kws)
+        self.codec = codec
+
+    def wrap(self, value, **kws) -> Value:
+        """
+        Wrap numpy.ndarray as a compressed NTNDArray Value.
         """
-        Initializes OnlineSurrogateModel.
+        if isinstance(value, Value):
+            return value
+
+        wrapped = super(CompressedNTNDArray, self).wrap(value, **kws)
+
+        data = np.ascontiguousarray(value)
+        compressed = compress_bytes(data.tobytes(), self.codec, data.itemsize)
+
+        wrapped["value"] = ("ubyteValue", np.frombuffer(compressed, dtype=np.uint8))
+        wrapped["codec.name"] = self.codec
+        wrapped["codec.parameters"] = ND_DATA_TYPES[data.dtype.name]
+        wrapped["compressedSize"] = len(compressed)
+        wrapped["uncompressedSize"] = data.nbytes
+
+        return wrapped
+
+
+class PendingPuts:
+    """
+    Put operations waiting for the outputs of their input state. A put completes \\
+    once the outputs of its input state, or of a newer one, have been posted, so \\
+    that clients reading the outputs after a put see its effect, while the handler \\
+    threads return without waiting for the model.
+    """
+
+    def __init__(self) -> None:
+        self._puts = []
+        self._lock = threading.Lock()
+
+    def add(self, sequence: int, op) -> None:
+        """
+        Hold a put operation until the outputs of its input state are posted.
 
         Parameters
         ----------
-        model_class
-            Model class to be instantiated
+        sequence: int
+            Sequence number of the input state set by the put
 
-        model_kwargs: dict
-            kwargs for initialization
+        op: p4p.server.raw.ServOpWrap
+            Server operation initiated by the put call
+
+        """
+        with self._lock:
+            self._puts.append((sequence, op))
+
+    def complete(self, sequence: int, error: str = None) -> None:
         """
+        Complete the put operations of the given input state and of all older \\
+        input states.
+
+        Parameters
+        ----------
+        sequence: int
+            Sequence number of the input state whose outputs were posted, or whose \\
+            evaluation failed
+
+        error: str, optional
+            Error message to fail the puts with
 
-        surrogate_model = model_class(**model_kwargs)
-        self.model = OnlineSurrogateModel([surrogate_model])
+        """
+        with self._lock:
+            done = [op for put_sequence, op in self._puts if put_sequence <= sequence]
+            self._puts = [put for put in self._puts if put[0] > sequence]
+
+        for op in done:
+            if error is None:
+                op.done()
+
+            else:
+                op.done(error=error)
 
 
 class InputHandler:
@@ -49,15 +148,22 @@ class InputHandler:
     process variables.
     """
 
-    def __init__(self, prefix):
-        self.prefix = prefix
+    def __init__(self, server) -> None:
+        """
+        Store the server owning the input state.
+
+        Parameters
+        ----------
+        server: online_model.server.pva.PVAServer
+            Server owning the input state and the output process variables
+        """
+        self.server = server
 
     def put(self, pv, op) -> None:
         """
-        Updates the global input process variable state, posts the input process \\
-        variable value change, runs the thread local OnlineSurrogateModel instance \\
-        using the updated global input process variable states, and posts the model \\
-        output values to the output process variables.
+        Updates the server input process variable state, posts the input process \\
+        variable value change, and submits the new input state for evaluation. The \\
+        put completes once the outputs of the new input state are posted.
 
         Parameters
         ----------
@@ -68,23 +174,176 @@ class InputHandler:
             Server operation initiated by the put call
 
         """
-        global providers
-        global input_pvs
-
-        # update input values and global input process variable state
+        # update input values and server input process variable state
         pv.post(op.value())
-        input_pvs[op.name().replace(f"{self.prefix}:", "")] = op.value()
 
-        # run model using global input process variable state
-        output_pv_state = model_loader.model.run(input_pvs)
+        sequence, pv_state = self.server.state.update(
+            {op.name().replace(f"{self.server.prefix}:", ""): op.value()}
+        )
+
+        # keep the aggregate input process variable in sync
+        self.server.post(INPUT_ARRAY_PV, [pv_state[key] for key in INPUT_ORDERING])
+
+        # the server marks the operation as complete once the outputs are posted
+        self.server.submit(pv_state, sequence, op)
+
+
+class InputArrayHandler(InputHandler):
+    """
+    Handler object that defines the callbacks to execute on put operations to the \\
+    aggregate input process variable, which sets every input in a single put.
+    """
+
+    def put(self, pv, op) -> None:
+        """
+        Atomically updates every input in the server input process variable state, \\
+        posts the input process variable value changes, and submits the new input \\
+        state for evaluation once. The put completes once the outputs of the new \\
+        input state are posted.
+
+        Parameters
+        ----------
+        pv: p4p.server.thread.SharedPV
+            Aggregate input process variable on which the put is operating
+
+        op: p4p.server.raw.ServOpWrap
+            Server operation initiated by the put call
+
+        """
+        values = [float(value) for value in op.value()]
+        if len(values) != len(INPUT_ORDERING):
+            op.done(error=f"{INPUT_ARRAY_PV} requires {len(INPUT_ORDERING)} values")
+            return
+
+        pv.post(values)
+
+        sequence, pv_state = self.server.state.update(dict(zip(INPUT_ORDERING, values)))
+
+        for input_pv, value in zip(INPUT_ORDERING, values):
+            self.server.post(input_pv, value)
+
+        # the server marks the operation as complete once the outputs are posted
+        self.server.submit(pv_state, sequence, op)
+
+
+class BatchHandler:
+    """
+    Handler object that defines the callbacks to execute on RPC operations to the \\
+    batch evaluation process variables. Each call evaluates the rows of an NTTable \\
+    in one batched model call without changing the served input state.
+    """
+
+    def __init__(self, server, images: bool = False) -> None:
+        """
+        Store the server whose model evaluates the batches.
+
+        Parameters
+        ----------
+        server: online_model.server.pva.PVAServer
+            Server owning the model and the input state
+
+        images: bool
+            If True, reply with the stacked image outputs instead of the scalar \\
+            output table
+
+        """
+        self.server = server
+        self.images = images
+
+    def rpc(self, pv, op) -> None:
+        """
+        Evaluates the input rows of the request table and replies with an NTTable \\
+        holding one column per scalar output, or with an NTNDArray holding the \\
+        stacked output images and their per row extents as attributes.
+
+        Columns are named after the model input names as pvData field names, ":" \\
+        replaced by "_". Inputs without a column take their current served value.
+
+        Parameters
+        ----------
+        pv: p4p.server.thread.SharedPV
+            Batch process variable on which the RPC is operating
+
+        op: p4p.server.raw.ServOpWrap
+            Server operation initiated by the RPC call
+
+        """
+        try:
+            columns = op.value()["value"].todict()
+
+        except (KeyError, AttributeError):
+            op.done(error="Batch evaluation requires an NTTable of input rows")
+            return
+
+        unknown = set(columns) - set(BATCH_INPUT_COLUMNS)
+        if unknown:
+            op.done(error=f"Unknown input columns: {', '.join(sorted(unknown))}")
+            return
+
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) != 1 or 0 in lengths:
+            op.done(error="Input columns must be non-empty and of equal length")
+            return
 
-        # now update output variables
-        for pv, value in output_pv_state.items():
-            output_provider = providers[f"{self.prefix}:{pv}"]
-            output_provider.post(value)
+        n_rows = lengths.pop()
 
-        # mark server operation as complete
-        op.done()
+        # read, but never modify, the served input state for missing columns
+        _, pv_state = self.server.state.snapshot()
+
+        for column, values in columns.items():
+            pv_state[BATCH_INPUT_COLUMNS[column]] = np.asarray(values, dtype=float)
+
+        vec = np.column_stack(
+            [np.broadcast_to(pv_state[key], n_rows) for key in INPUT_ORDERING]
+        )
+
+        try:
+            output = self.server.model.run_columns(vec)
+
+        except Exception as e:
+            op.done(error=str(e))
+            return
+
+        if self.images:
+            op.done(self.build_image_stack(output))
+
+        else:
+            op.done(self.build_table(output))
+
+    def build_table(self, output: Dict[str, np.ndarray]) -> Value:
+        """
+        Build the NTTable of scalar outputs, labeled with the output names.
+        """
+        scalars = [pv for pv in output if pv not in ARRAY_PVS]
+        nt = NTTable(columns=[(pva_field_name(pv), "d") for pv in scalars])
+
+        return Value(
+            nt.type,
+            {
+                "labels": scalars,
+                "value": {pva_field_name(pv): output[pv] for pv in scalars},
+            },
+        )
+
+    def build_image_stack(self, output: Dict[str, np.ndarray]) -> Value:
+        """
+        Build the NTNDArray of stacked images, with the image extents as attributes. \\
+        The stack is published as monochrome, so that the color mode is not deduced \\
+        from the shape: a stack of 3 rows would otherwise be taken for an RGB image \\
+        and any other number of rows rejected.
+        """
+        pv = ARRAY_PVS[0]
+        array_data = np.ascontiguousarray(output[pv]).view(NTNDArrayData)
+        array_data.attrib = {
+            "ColorMode": DEFAULT_COLOR_MODE,
+            "dw": output[f"{pv}:dw"],
+            "dh": output[f"{pv}:dh"],
+        }
+
+        if ARRAY_ENCODINGS[pv]["codec"]:
+            return CompressedNTNDArray(ARRAY_ENCODINGS[pv]["codec"]).wrap(array_data)
+
+        return NTNDArray().wrap(array_data)
 
 
 class PVAServer:
@@ -101,6 +360,18 @@ class PVAServer:
         Dictionary that maps the output process variable string to type (str), prec \\
         (precision), value (float), units (str), range (List[float])
 
+    providers: dict
+        Mapping of process variable names to SharedPV instances
+
+    state: online_model.server.state.StateStore
+        Versioned input process variable state
+
+    coalesce: bool
+        Whether only the latest input state is evaluated
+
+    stale_drops: int
+        Number of input states superseded by a newer put before being evaluated
+
     """
 
     def __init__(
@@ -110,10 +381,16 @@ class PVAServer:
         in_pvdb: Dict[str, dict],
         out_pvdb: Dict[str, dict],
         prefix: str,
+        max_batch_size: int = 16,
+        max_batch_wait: float = 0.005,
+        cache_size: int = 0,
+        num_processes: int = 0,
+        num_workers: int = 1,
+        coalesce: bool = False,
     ) -> None:
         """
-        Initialize the global process variable list, populate the initial values for \\
-        the global input variable state, generate starting output from the main thread \\
+        Initialize the process variable list, populate the initial values for the \\
+        versioned input variable state, generate starting output from the shared \\
         OnlineSurrogateModel model instance, and initialize input and output process \\
         variables.
 
@@ -135,16 +412,43 @@ class PVAServer:
 
         prefix: str
             Prefix to use when serving
+
+        max_batch_size: int
+            Maximum number of pending puts evaluated in one batched model call
+
+        max_batch_wait: float
+            Maximum time in seconds to wait for additional puts before evaluating a \\
+            batch
+
+        cache_size: int
+            Number of model outputs to cache, keyed on the input state quantized to \\
+            the input process variable precision. Caching is disabled if 0.
+
+        num_processes: int
+            Number of worker processes evaluating the model. If 0, the model is \\
+            loaded in the server process.
+
+        num_workers: int
+            Number of inference threads sharing the model
+
+        coalesce: bool
+            If True, an inference worker evaluates the latest input state, \\
+            superseding the states put during an evaluation
         """
-        # need these to be global to access from threads
-        global providers
-        global input_pvs
-        global model_loader
-        providers = {}
-        input_pvs = {}
+        self.prefix = prefix
+        self.providers = {}
+
+        cache = None
+        if cache_size:
+            cache = PredictionCache(
+                cache_size, {pv: in_pvdb[pv]["prec"] for pv in in_pvdb}
+            )
 
-        # initialize loader for model
-        model_loader = ModelLoader(model_class, model_kwargs)
+        # load the model once; it is shared read-only by all inference workers
+        surrogate_model = build_surrogate_model(
+            model_class, model_kwargs, num_processes
+        )
+        self.model = OnlineSurrogateModel([surrogate_model], cache=cache)
 
         # these aren't currently used; but, probably not a bad idea to have around
         # for introspection
@@ -152,23 +456,49 @@ class PVAServer:
         self.out_pvdb = out_pvdb
 
         # initialize model and state
-        for in_pv in in_pvdb:
-            input_pvs[in_pv] = in_pvdb[in_pv]["value"]
-
-        # use main thread loaded model to do initial model run
-        starting_output = model_loader.model.run(input_pvs)
+        self.state = StateStore({in_pv: in_pvdb[in_pv]["value"] for in_pv in in_pvdb})
+        self.coalesce = coalesce
+        self.stale_drops = 0
+        self.input_changed = threading.Event()
+        self.pending_puts = PendingPuts()
+        self._stats_lock = threading.Lock()
+
+        # coalesce puts from all handler threads into batched model calls evaluated
+        # by a fixed pool of inference workers, skipping superseded input states
+        self.batcher = MicroBatcher(
+            self.model.run_batch,
+            max_batch_size=max_batch_size,
+            max_wait=max_batch_wait,
+            num_workers=num_workers,
+            is_superseded=self.state.is_superseded,
+        )
+
+        # do initial model run
+        sequence, pv_state = self.state.snapshot()
+        starting_output = self.model.run(pv_state)
+
+        # track published outputs, starting from the initial values
+        self.output_filter = OutputChangeFilter(out_pvdb)
+        with self.state.publishing(sequence):
+            self.output_filter.changed(starting_output)
 
         # create PVs for model inputs
         for in_pv in in_pvdb:
             pvname = f"{prefix}:{in_pv}"
+            # Use InputHandler class to handle callbacks
             pv = SharedPV(
-                handler=InputHandler(
-                    prefix
-                ),  # Use InputHandler class to handle callbacks
+                handler=InputHandler(self),
                 nt=NTScalar("d"),
                 initial=in_pvdb[in_pv]["value"],
             )
-            providers[pvname] = pv
+            self.providers[pvname] = pv
+
+        # create aggregate input PV, ordered as the model inputs
+        self.providers[f"{prefix}:{INPUT_ARRAY_PV}"] = SharedPV(
+            handler=InputArrayHandler(self),
+            nt=NTScalar("ad"),
+            initial=[in_pvdb[in_pv]["value"] for in_pv in INPUT_ORDERING],
+        )
 
         # use default handler for the output process variables
         # updates to output pvs are handled from post calls within the input update
@@ -177,17 +507,203 @@ class PVAServer:
             if out_pv not in ARRAY_PVS:
                 pv = SharedPV(nt=NTScalar(), initial=value)
 
+            elif ARRAY_ENCODINGS[out_pv]["codec"]:
+                pv = SharedPV(
+                    nt=CompressedNTNDArray(ARRAY_ENCODINGS[out_pv]["codec"]),
+                    initial=value,
+                )
+
             elif out_pv in ARRAY_PVS:
-                pv = SharedPV(nt=NTNDArray(), initial=value)
+                pv = SharedPV(nt=SequencedNTNDArray(), initial=value)
 
-            providers[pvname] = pv
+            self.providers[pvname] = pv
 
         else:
             pass  # throw exception for incorrect data type
 
+        # serve statistics alongside the outputs
+        for stats_pv in STATS_PVDB:
+            pvname = f"{prefix}:{stats_pv}"
+            self.providers[pvname] = SharedPV(
+                nt=NTScalar("l"), initial=STATS_PVDB[stats_pv]["value"]
+            )
+
+        # aggregate snapshot of the scalar outputs of one evaluation
+        self.providers[f"{prefix}:{SNAPSHOT_PV}"] = SharedPV(
+            nt=NTScalar("ad"), initial=format_snapshot(sequence, starting_output)
+        )
+
+        # batch evaluation endpoints, independent of the served input state
+        self.providers[f"{prefix}:{BATCH_PV}"] = SharedPV(
+            handler=BatchHandler(self), nt=NTScalar("l"), initial=0
+        )
+        self.providers[f"{prefix}:{BATCH_IMAGE_PV}"] = SharedPV(
+            handler=BatchHandler(self, images=True), nt=NTScalar("l"), initial=0
+        )
+
+    def post(self, pv: str, value, **kws) -> None:
+        """
+        Post a value to a served process variable.
+
+        Parameters
+        ----------
+        pv: str
+            Process variable name, without prefix
+
+        value
+            Value to post
+
+        kws
+            Passed on to the wrap method of the process variable type, e.g. the \\
+            unique_id of image frames
+
+        """
+        self.providers[f"{self.prefix}:{pv}"].post(value, **kws)
+
+    def submit(self, pv_state: Dict[str, float], sequence: int, op=None) -> None:
+        """
+        Submit an input state for evaluation without waiting for the model. When \\
+        coalescing, the inference worker is signaled to evaluate the latest state \\
+        held by the state store; otherwise the state is queued to the batcher, \\
+        batched together with the puts pending from every handler thread, and its \\
+        outputs are posted once evaluated.
+
+        Parameters
+        ----------
+        pv_state: dict
+            Snapshot of the input process variable state
+
+        sequence: int
+            Sequence number of the input process variable state
+
+        op: p4p.server.raw.ServOpWrap, optional
+            Put operation to complete once the outputs of the input state, or of a \\
+            newer one, are posted
+
+        """
+        if op is not None:
+            self.pending_puts.add(sequence, op)
+
+        if self.coalesce:
+            self.input_changed.set()
+
+        else:
+            request = self.batcher.submit(pv_state, sequence)
+            request.add_done_callback(self.publish_request)
+
+    def run_inference(self) -> None:
+        """
+        Inference worker loop used when coalescing. Waits for an input change, then \\
+        evaluates the model on a snapshot of the input process variable state. Puts \\
+        arriving during an evaluation are coalesced, so only the latest input state \\
+        is evaluated next.
+        """
+        evaluated_version = self.state.sequence
+
+        while True:
+            self.input_changed.wait()
+            self.input_changed.clear()
+
+            # puts arriving after the clear set the event again
+            input_version, pv_state = self.state.snapshot()
+
+            # every put between two evaluations except the latest is dropped
+            if input_version > evaluated_version + 1:
+                self.count_stale_drops(input_version - evaluated_version - 1)
+            evaluated_version = input_version
+
+            try:
+                output_pv_state = self.batcher.run(pv_state, input_version)
+
+            except Exception as e:
+                print(f"Model evaluation failed for input version {input_version}: {e}")
+                self.pending_puts.complete(input_version, error=str(e))
+
+            else:
+                # superseded while queued, the newer put has set the event again
+                if output_pv_state is None:
+                    self.count_stale_drops(1)
+
+                else:
+                    self.publish_outputs(output_pv_state, input_version)
+
+    def count_stale_drops(self, count: int) -> None:
+        """
+        Count input states superseded before being evaluated.
+        """
+        with self._stats_lock:
+            self.stale_drops += count
+
+    def publish_request(self, request: BatchRequest) -> None:
+        """
+        Batch request callback, run on the batcher worker once the input state of a \\
+        put has been evaluated or skipped. Posts the changed model output values \\
+        unless outputs of a newer input state have already been posted, or fails \\
+        the pending puts if the evaluation failed. Puts of skipped input states are \\
+        completed with the outputs of the newer state that superseded them.
+
+        Parameters
+        ----------
+        request: online_model.server.inference.BatchRequest
+            Evaluated request
+
+        """
+        if request.error is not None:
+            print(f"Model evaluation failed for input version {request.sequence}")
+            print(request.error)
+            self.pending_puts.complete(request.sequence, error=str(request.error))
+            return
+
+        if request.superseded:
+            self.count_stale_drops(1)
+            return
+
+        self.publish_outputs(request.result, request.sequence)
+
+    def publish_outputs(
+        self, output_pv_state: Mapping[str, Union[float, np.ndarray]], sequence: int
+    ) -> None:
+        """
+        Post the changed model outputs, the aggregate snapshot and the server \\
+        statistics, unless outputs of a newer input state have been posted, and \\
+        complete the puts of the input state and of older input states.
+
+        Parameters
+        ----------
+        output_pv_state: dict
+            Mapping of output process variables to model output values
+
+        sequence: int
+            Sequence number of the input state the outputs were evaluated from
+
+        """
+        with self.state.publishing(sequence) as current:
+            if current:
+                # now update output variables that changed by more than their deadband
+                for pv, value in self.output_filter.changed(output_pv_state).items():
+                    if pv in ARRAY_PVS:
+                        # frames are identified by the input sequence they came from
+                        self.post(pv, value, unique_id=sequence)
+
+                    else:
+                        self.post(pv, value)
+
+                self.post(SNAPSHOT_PV, format_snapshot(sequence, output_pv_state))
+
+            # report requests superseded while waiting for evaluation and results
+            # discarded as stale
+            self.post("stale_drops", self.stale_drops)
+            self.post("stale_results", self.state.stale_results)
+
+        self.pending_puts.complete(sequence)
+
     def start_server(self) -> None:
         """
         Starts the server and runs until KeyboardInterrupt.
         """
+        if self.coalesce:
+            inference_worker = threading.Thread(target=self.run_inference, daemon=True)
+            inference_worker.start()
+
         print("Starting Server...")
-        Server.forever(providers=[providers])
+        Server.forever(providers=[self.providers])
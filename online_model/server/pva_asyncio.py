@@ -0,0 +1,359 @@
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Mapping, Union
+
+from p4p.nt import NTScalar
+from p4p.server.asyncio import SharedPV
+from p4p.server import Server
+
+from online_model.model.surrogate_model import OnlineSurrogateModel
+from online_model.model.cache import PredictionCache
+from online_model.model.engine import build_surrogate_model
+from online_model.server.changes import OutputChangeFilter
+from online_model.server.state import StateStore
+from online_model.server.pva import CompressedNTNDArray, SequencedNTNDArray, PendingPuts
+from online_model.model import format_snapshot
+from online_model import (
+    ARRAY_PVS,
+    ARRAY_ENCODINGS,
+    STATS_PVDB,
+    INPUT_ARRAY_PV,
+    INPUT_ORDERING,
+    SNAPSHOT_PV,
+)
+
+
+class AsyncInputHandler:
+    """
+    Handler object that defines the callbacks to execute on put operations to input \\
+    process variables. The handler returns once the input is accepted, and the put \\
+    completes once the server has posted the outputs of the new input state.
+    """
+
+    def __init__(self, server) -> None:
+        """
+        Store the server owning the input state.
+
+        Parameters
+        ----------
+        server: online_model.server.pva_asyncio.AsyncPVAServer
+            Server owning the input state
+        """
+        self.server = server
+
+    def put(self, pv, op) -> None:
+        """
+        Posts the input process variable value change and updates the server input \\
+        state.
+
+        Parameters
+        ----------
+        pv: p4p.server.asyncio.SharedPV
+            Input process variable on which the put is operating
+
+        op: p4p.server.raw.ServOpWrap
+            Server operation initiated by the put call
+
+        """
+        pv.post(op.value())
+        # the server marks the operation as complete once the outputs are posted
+        self.server.set_inputs(
+            {op.name().replace(f"{self.server.prefix}:", ""): op.value()}, op
+        )
+
+
+class AsyncInputArrayHandler(AsyncInputHandler):
+    """
+    Handler object that defines the callbacks to execute on put operations to the \\
+    aggregate input process variable, which sets every input in a single put.
+    """
+
+    def put(self, pv, op) -> None:
+        """
+        Posts the input process variable value changes and updates every input in \\
+        the server input state at once.
+
+        Parameters
+        ----------
+        pv: p4p.server.asyncio.SharedPV
+            Aggregate input process variable on which the put is operating
+
+        op: p4p.server.raw.ServOpWrap
+            Server operation initiated by the put call
+
+        """
+        values = [float(value) for value in op.value()]
+        if len(values) != len(INPUT_ORDERING):
+            op.done(error=f"{INPUT_ARRAY_PV} requires {len(INPUT_ORDERING)} values")
+            return
+
+        pv.post(values)
+        for input_pv, value in zip(INPUT_ORDERING, values):
+            self.server.providers[f"{self.server.prefix}:{input_pv}"].post(value)
+
+        # the server marks the operation as complete once the outputs are posted
+        self.server.set_inputs(dict(zip(INPUT_ORDERING, values)), op)
+
+
+class AsyncPVAServer:
+    """
+    Server object for PVA process variables running on an asyncio event loop. Put \\
+    handlers return without waiting for the model, inference runs in an executor \\
+    and outputs are posted from the event loop, completing the puts. Input changes \\
+    arriving during an inference are coalesced, so only the latest input state is \\
+    evaluated next.
+
+    Attributes
+    ----------
+    loop: asyncio.AbstractEventLoop
+        Event loop serving the process variables
+
+    model: online_model.model.surrogate_model.OnlineSurrogateModel
+        OnlineSurrogateModel instance used for getting predictions
+
+    providers: dict
+        Mapping of process variable names to SharedPV instances
+
+    state: online_model.server.state.StateStore
+        Versioned input process variable state
+
+    stale_drops: int
+        Number of input states superseded by a newer put before being evaluated
+
+    """
+
+    def __init__(
+        self,
+        model_class,
+        model_kwargs: dict,
+        in_pvdb: Dict[str, dict],
+        out_pvdb: Dict[str, dict],
+        prefix: str,
+        cache_size: int = 0,
+        num_processes: int = 0,
+    ) -> None:
+        """
+        Load the model, generate the starting output and create the input and output \\
+        process variables on the event loop.
+
+        Parameters
+        ----------
+        model_class: class
+            Model class to be instantiated
+
+        model_kwargs: dict
+            kwargs for initialization
+
+        in_pvdb: dict
+            Dictionary that maps the input process variable string to type (str), \\
+            prec (precision), value (float), units (str), range (List[float])
+
+        out_pvdb: dict
+            Dictionary that maps the output process variable string to type (str), \\
+            prec (precision), value (float), units (str), range (List[float])
+
+        prefix: str
+            Prefix to use when serving
+
+        cache_size: int
+            Number of model outputs to cache, keyed on the input state quantized to \\
+            the input process variable precision. Caching is disabled if 0.
+
+        num_processes: int
+            Number of worker processes evaluating the model. If 0, the model is \\
+            loaded in the server process.
+        """
+        self.prefix = prefix
+        self.loop = asyncio.get_event_loop()
+
+        # the evaluation task only awaits one evaluation at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        cache = None
+        if cache_size:
+            cache = PredictionCache(
+                cache_size, {pv: in_pvdb[pv]["prec"] for pv in in_pvdb}
+            )
+
+        surrogate_model = build_surrogate_model(
+            model_class, model_kwargs, num_processes
+        )
+        self.model = OnlineSurrogateModel([surrogate_model], cache=cache)
+
+        # initialize model and state
+        self.state = StateStore({in_pv: in_pvdb[in_pv]["value"] for in_pv in in_pvdb})
+        self.stale_drops = 0
+        self.input_changed = asyncio.Event()
+        self.pending_puts = PendingPuts()
+
+        # do initial model run
+        sequence, pv_state = self.state.snapshot()
+        starting_output = self.model.run(pv_state)
+
+        # track published outputs, starting from the initial values
+        self.output_filter = OutputChangeFilter(out_pvdb)
+        with self.state.publishing(sequence):
+            self.output_filter.changed(starting_output)
+
+        self.providers = {}
+
+        # create PVs for model inputs
+        for in_pv in in_pvdb:
+            self.providers[f"{prefix}:{in_pv}"] = SharedPV(
+                handler=AsyncInputHandler(self),
+                nt=NTScalar("d"),
+                initial=in_pvdb[in_pv]["value"],
+                loop=self.loop,
+            )
+
+        # create aggregate input PV, ordered as the model inputs
+        self.providers[f"{prefix}:{INPUT_ARRAY_PV}"] = SharedPV(
+            handler=AsyncInputArrayHandler(self),
+            nt=NTScalar("ad"),
+            initial=[in_pvdb[in_pv]["value"] for in_pv in INPUT_ORDERING],
+            loop=self.loop,
+        )
+
+        # output pvs are posted from the event loop after each evaluation
+        for out_pv, value in starting_output.items():
+            if out_pv not in ARRAY_PVS:
+                nt = NTScalar()
+
+            elif ARRAY_ENCODINGS[out_pv]["codec"]:
+                nt = CompressedNTNDArray(ARRAY_ENCODINGS[out_pv]["codec"])
+
+            else:
+                nt = SequencedNTNDArray()
+
+            self.providers[f"{prefix}:{out_pv}"] = SharedPV(
+                nt=nt, initial=value, loop=self.loop
+            )
+
+        # aggregate snapshot of the scalar outputs of one evaluation
+        self.providers[f"{prefix}:{SNAPSHOT_PV}"] = SharedPV(
+            nt=NTScalar("ad"),
+            initial=format_snapshot(sequence, starting_output),
+            loop=self.loop,
+        )
+
+        # serve statistics alongside the outputs
+        for stats_pv in STATS_PVDB:
+            self.providers[f"{prefix}:{stats_pv}"] = SharedPV(
+                nt=NTScalar("l"), initial=STATS_PVDB[stats_pv]["value"], loop=self.loop
+            )
+
+    def set_inputs(self, inputs: Dict[str, float], op=None) -> None:
+        """
+        Update the input process variable state and signal the evaluation task. \\
+        Called from the event loop.
+
+        Parameters
+        ----------
+        inputs: dict
+            Mapping of input process variables to their new values
+
+        op: p4p.server.raw.ServOpWrap, optional
+            Put operation to complete once the outputs of the new input state, or \\
+            of a newer one, are posted
+
+        """
+        sequence, pv_state = self.state.update(inputs)
+
+        if op is not None:
+            self.pending_puts.add(sequence, op)
+
+        # keep the aggregate input process variable in sync
+        self.providers[f"{self.prefix}:{INPUT_ARRAY_PV}"].post(
+            [pv_state[key] for key in INPUT_ORDERING]
+        )
+
+        self.input_changed.set()
+
+    async def evaluate_inputs(self) -> None:
+        """
+        Evaluation task. Waits for an input change, runs the model on a snapshot of \\
+        the input state in the executor and posts the changed outputs.
+        """
+        evaluated_version = self.state.sequence
+
+        while True:
+            await self.input_changed.wait()
+            self.input_changed.clear()
+
+            input_version, pv_state = self.state.snapshot()
+
+            # every input change between two evaluations except the latest is dropped
+            if input_version > evaluated_version + 1:
+                self.stale_drops += input_version - evaluated_version - 1
+            evaluated_version = input_version
+
+            try:
+                output_pv_state = await self.loop.run_in_executor(
+                    self.executor, self.model.run, pv_state
+                )
+
+            except Exception as e:
+                print(f"Model evaluation failed for input version {evaluated_version}")
+                print(e)
+                self.pending_puts.complete(evaluated_version, error=str(e))
+                continue
+
+            self.post_outputs(output_pv_state, evaluated_version)
+
+    def post_outputs(
+        self, output_pv_state: Mapping[str, Union[float, np.ndarray]], sequence: int
+    ) -> None:
+        """
+        Post the changed model outputs, the aggregate snapshot and the server \\
+        statistics, unless outputs of a newer input state have been posted, and \\
+        complete the puts of the input state and of older input states.
+
+        Parameters
+        ----------
+        output_pv_state: dict
+            Mapping of output process variables to model output values
+
+        sequence: int
+            Input version the outputs were evaluated from
+
+        """
+        with self.state.publishing(sequence) as current:
+            if current:
+                for pv, value in self.output_filter.changed(output_pv_state).items():
+                    provider = self.providers[f"{self.prefix}:{pv}"]
+
+                    if pv in ARRAY_PVS:
+                        # frames are identified by the input sequence they came from
+                        provider.post(value, unique_id=sequence)
+
+                    else:
+                        provider.post(value)
+
+                self.providers[f"{self.prefix}:{SNAPSHOT_PV}"].post(
+                    format_snapshot(sequence, output_pv_state)
+                )
+
+            self.providers[f"{self.prefix}:stale_drops"].post(self.stale_drops)
+            self.providers[f"{self.prefix}:stale_results"].post(
+                self.state.stale_results
+            )
+
+        self.pending_puts.complete(sequence)
+
+    def start_server(self) -> None:
+        """
+        Starts the server and runs the event loop until KeyboardInterrupt.
+        """
+        print("Starting Server...")
+        with Server(providers=[self.providers]):
+            self.loop.create_task(self.evaluate_inputs())
+
+            try:
+                self.loop.run_forever()
+
+            except KeyboardInterrupt:
+                pass
+
+            finally:
+                self.executor.shutdown()
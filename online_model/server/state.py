@@ -0,0 +1,110 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Mapping, Tuple
+
+
+class StateStore:
+    """
+    Versioned input process variable state shared by the server threads. Every \\
+    input change is assigned a monotonically increasing sequence number, and model \\
+    outputs are published tagged with the sequence of the input state they were \\
+    evaluated from. Outputs older than the latest published sequence are discarded.
+
+    Attributes
+    ----------
+    sequence: int
+        Sequence number of the latest input state
+
+    published_sequence: int
+        Sequence number of the input state behind the latest published outputs
+
+    stale_results: int
+        Number of output sets discarded because newer outputs had been published
+
+    """
+
+    def __init__(self, input_state: Dict[str, float]) -> None:
+        """
+        Store the initial input state as sequence 0.
+
+        Parameters
+        ----------
+        input_state: dict
+            Mapping of input process variables to their initial values
+
+        """
+        self.sequence = 0
+        self.published_sequence = -1
+        self.stale_results = 0
+
+        self._input_state = dict(input_state)
+        self._input_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def update(self, inputs: Mapping[str, float]) -> Tuple[int, Dict[str, float]]:
+        """
+        Apply an input change and assign it the next sequence number.
+
+        Parameters
+        ----------
+        inputs: dict
+            Mapping of the changed input process variables to their new values
+
+        Returns
+        -------
+        tuple
+            Sequence number and a copy of the resulting input state
+        """
+        with self._input_lock:
+            self._input_state.update(inputs)
+            self.sequence += 1
+            return self.sequence, dict(self._input_state)
+
+    def snapshot(self) -> Tuple[int, Dict[str, float]]:
+        """
+        Get a consistent snapshot of the input state.
+
+        Returns
+        -------
+        tuple
+            Sequence number and a copy of the input state
+        """
+        with self._input_lock:
+            return self.sequence, dict(self._input_state)
+
+    def is_superseded(self, sequence: int) -> bool:
+        """
+        Whether a newer input state than the given input sequence exists, so that \\
+        evaluating it would only produce stale outputs.
+        """
+        return sequence < self.sequence
+
+    def is_stale(self, sequence: int) -> bool:
+        """
+        Whether outputs for the given input sequence would be discarded, as outputs \\
+        of the same or a newer input state have already been published.
+        """
+        return sequence <= self.published_sequence
+
+    @contextmanager
+    def publishing(self, sequence: int) -> Iterator[bool]:
+        """
+        Context manager serializing output publication. Yields True if the outputs \\
+        of the given input sequence are newer than any published so far and should \\
+        be posted, False if they are stale and should be discarded. Posts made \\
+        within the context cannot be overtaken by outputs of an older sequence.
+
+        Parameters
+        ----------
+        sequence: int
+            Sequence number of the input state the outputs were evaluated from
+
+        """
+        with self._publish_lock:
+            if self.is_stale(sequence):
+                self.stale_results += 1
+                yield False
+
+            else:
+                self.published_sequence = sequence
+                yield True
@@ -1,5 +1,43 @@
+import re
+import zlib
 import numpy as np
 
+# optional compression codecs
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+# pcaspy types used to serve each supported image encoding over channel access;
+# pcaspy has no single precision type so float32 is served as double
+CA_ARRAY_TYPES = {
+    "float64": "float",
+    "float32": "float",
+    "uint16": "int",
+    "uint8": "char",
+}
+
+# NDArray data type codes used in the NTNDArray codec parameters
+ND_DATA_TYPES = {
+    "int8": 0,
+    "uint8": 1,
+    "int16": 2,
+    "uint16": 3,
+    "int32": 4,
+    "uint32": 5,
+    "int64": 6,
+    "uint64": 7,
+    "float32": 8,
+    "float64": 9,
+}
+
+CODECS = ["zlib", "lz4", "blosc"]
+
 
 def fix_units(unit_str):
 
@@ -12,7 +50,22 @@ def fix_units(unit_str):
     return unit_str
 
 
-def build_image_pvs(pvname, image_shape, image_units, precision, color_mode):
+def pva_field_name(name):
+    """
+    Convert a process variable name into a valid pvData field name, replacing the \\
+    characters pvData does not allow (e.g. ":") with underscores.
+    """
+    field_name = re.sub(r"[^A-Za-z0-9_]", "_", name)
+
+    if field_name[:1].isdigit():
+        field_name = f"_{field_name}"
+
+    return field_name
+
+
+def build_image_pvs(
+    pvname, image_shape, image_units, precision, color_mode, dtype="float64"
+):
     ndim = len(image_shape)
 
     # confirm dimensions make sense
@@ -34,12 +87,13 @@ def build_image_pvs(pvname, image_shape, image_units, precision, color_mode):
         f"{pvname}:ArraySizeX_RBV": {"type": "int", "value": image_shape[0]},
         f"{pvname}:ArraySize_RBV": {"type": "int", "value": int(np.prod(image_shape))},
         f"{pvname}:ArrayData_RBV": {
-            "type": "float",
+            "type": CA_ARRAY_TYPES[dtype],
             "prec": precision,
             "count": int(np.prod(image_shape)),
             "units": image_units,
         },
         f"{pvname}:ColorMode_RBV": {"type": "int", "value": color_mode},
+        f"{pvname}:ArrayCounter_RBV": {"type": "int", "value": 0},
         f"{pvname}:dw": {"type": "float", "prec": precision},
         f"{pvname}:dh": {"type": "float", "prec": precision},
     }
@@ -51,4 +105,87 @@ def build_image_pvs(pvname, image_shape, image_units, precision, color_mode):
     if ndim > 2:
         pvdb[f"{pvname}:ArraySizeZ_RBV"] = {"type": "int", "value": image_shape[2]}
 
+    # integer encoded data is published with the scale and offset to decode it, in
+    # one waveform with the array counter of the frame they belong to
+    if np.dtype(dtype).kind == "u":
+        pvdb[f"{pvname}:encoding"] = {
+            "type": "float",
+            "prec": precision,
+            "count": 3,
+            "value": [0, 1, 0],
+        }
+
     return pvdb
+
+
+def encode_array(values, dtype):
+    """
+    Encode an array with the given dtype. Unsigned integer encodings map the value \
+    range of the array onto the full integer range.
+
+    Returns
+    -------
+    tuple
+        Encoded array, scale and offset such that values = offset + scale * encoded
+    """
+    dtype = np.dtype(dtype)
+
+    if dtype.kind == "f":
+        return values.astype(dtype, copy=False), 1.0, 0.0
+
+    offset = float(values.min())
+    value_range = float(values.max()) - offset
+    scale = value_range / np.iinfo(dtype).max if value_range > 0 else 1.0
+    encoded = np.round((values - offset) / scale).astype(dtype)
+
+    return encoded, scale, offset
+
+
+def decode_array(encoded, scale=1.0, offset=0.0):
+    """
+    Decode an array produced by encode_array.
+    """
+    if encoded.dtype.kind == "f" and scale == 1.0 and offset == 0.0:
+        return encoded
+
+    return offset + scale * encoded.astype(np.float64)
+
+
+def compress_bytes(data, codec, typesize=8):
+    """
+    Compress a bytes buffer with the named codec ("zlib", "lz4" or "blosc").
+    """
+    if codec == "zlib":
+        return zlib.compress(data)
+
+    elif codec == "lz4":
+        if lz4_block is None:
+            raise ImportError("The lz4 codec requires the lz4 package.")
+        return lz4_block.compress(data, store_size=False)
+
+    elif codec == "blosc":
+        if blosc is None:
+            raise ImportError("The blosc codec requires the blosc package.")
+        return blosc.compress(data, typesize=typesize)
+
+    raise ValueError(f"Unsupported codec {codec}, options are {CODECS}")
+
+
+def decompress_bytes(data, codec, uncompressed_size):
+    """
+    Decompress a bytes buffer compressed with compress_bytes.
+    """
+    if codec == "zlib":
+        return zlib.decompress(data)
+
+    elif codec == "lz4":
+        if lz4_block is None:
+            raise ImportError("The lz4 codec requires the lz4 package.")
+        return lz4_block.decompress(data, uncompressed_size=uncompressed_size)
+
+    elif codec == "blosc":
+        if blosc is None:
+            raise ImportError("The blosc codec requires the blosc package.")
+        return blosc.decompress(data)
+
+    raise ValueError(f"Unsupported codec {codec}, options are {CODECS}")